@@ -4,77 +4,240 @@
 # Import dependencies
 import pytesseract
 import argparse
+import multiprocessing
 import cv2
 import os
 from src import *
 
 PAGE_ROI = (80, 0, 3350, 5220)
+BATCH_TIMEOUT = 60 * 60 * 24 * 7
+DEFAULT_REVIEW_DIR = 'review/annuary'
 
 def process_image(args, annuary_data):
-  print('Processing file ' + args.input + '...')
+  reading_errors = read_image(args.input, annuary_data, args)
+  if reading_errors == None:
+    return
 
-  if not os.path.exists(args.input):
-    print('Error on reading or file input dont exist. ( ∩ ︵ ∩ )')
+  if args.defer_errors:
+    queue_reading_errors(reading_errors, args.input, args)
     return
 
-  # Read image source and crop it
-  image_src = cv2.imread(args.input)
-  image_src = crop_roi(image_src, PAGE_ROI)
+  print('Finished with ' + str(len(reading_errors)) + ' errors.')
+
+  # Fix errors if exist
+  if len(reading_errors) > 0:
+    fix_reading_errors(reading_errors, annuary_data)
+    print('Thanks (✿ ♥ ‿ ♥ )!')
+  else:
+    print('Perfect (✿ ♥ ‿ ♥ )!')
+
+def read_image(image_path, annuary_data, args):
+  print('Processing file ' + image_path + '...')
+
+  if not os.path.exists(image_path):
+    print('Error on reading or file input dont exist. ( ∩ ︵ ∩ )')
+    return None
+
+  # Read image source as grayscale and crop it
+  page = PageContext(image_path, PAGE_ROI)
+  if not page.load(args.stream):
+    print('Error on reading or file input dont exist. ( ∩ ︵ ∩ )')
+    return None
+
   if args.debug:
-    show_scaled_image('source', image_src, 0.4)
+    show_scaled_image('source', page.gray, 0.4)
+
+  # Get binary image, packed strip by strip on streaming mode
+  if args.stream:
+    binary_image = page.get_strip_binary()
+    page.release_gray()
+  else:
+    binary_image = page.get_binary()
 
-  # Get binary image
-  binary_image = binarize_image(image_src)
   if args.debug:
     show_scaled_image('binary', binary_image, 0.4)
   
   # Get columns
-  cols = find_columns_on_annuary(binary_image, args)
+  with timed('columns'):
+    cols = find_columns_on_annuary(binary_image, args)
 
   # Process rows from each column
   print('Processing rows...')
 
+  # Read the columns on threads, merge them in order on this one
+  col_threads = 1 if args.debug else args.col_threads
+  read_col = lambda col: read_col_rows(crop_roi(binary_image, col), args)
+
   reading_errors = []
-  for col in cols:
-    img_col = crop_roi(binary_image, col)
+  readed_ids = []
+  for img_col, rows, readeds in ordered_thread_map(read_col, cols, col_threads):
+    reading_errors += process_rows(img_col, rows, readeds, annuary_data, args, readed_ids)
 
-    # Get rows and process rows
-    rows = find_rows_on_annuary(img_col, args)
-    reading_errors += process_rows(img_col, rows, annuary_data, args)
+  annuary_data.checkpoint()
+  print_page_missings(readed_ids, annuary_data)
+
+  return reading_errors
+
+def process_batch(args, annuary_data):
+  image_paths = get_input_files(args.input)
+  if len(image_paths) == 0:
+    print('Error on reading or file input dont exist. ( ∩ ︵ ∩ )')
+    return
+
+  print('Processing ' + str(len(image_paths)) + ' files with ' + str(args.jobs) + ' workers...')
+
+  # Read all pages on the pool, each worker loads its own data once
+  pool = multiprocessing.Pool(args.jobs, init_batch_worker, (args,))
+  try:
+    results = pool.map_async(process_batch_file, image_paths, 1).get(BATCH_TIMEOUT)
+    pool.close()
+  except KeyboardInterrupt:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+
+  # Merge results in files order
+  reading_errors = []
+  for registers, errors in results:
+    for register in registers:
+      annuary_data.add_register(register)
+
+    reading_errors += errors
 
   print('Finished with ' + str(len(reading_errors)) + ' errors.')
 
-  # Fix errors if exist
+  # Fix errors if exist, the fixes are measured apart from the pages
   if len(reading_errors) > 0:
+    start_page('review')
     fix_reading_errors(reading_errors, annuary_data)
+    end_page()
     print('Thanks (✿ ♥ ‿ ♥ )!')
   else:
     print('Perfect (✿ ♥ ‿ ♥ )!')
 
-def process_rows(img_col, rows, annuary_data, args):
+def init_batch_worker(args):
+  global batch_args, batch_annuary_data
 
-  reading_errors = []
+  batch_args = args
+  batch_annuary_data = open_annuary_data(args.output, False)
 
-  for i, row in enumerate(rows):
-    
-    # Get ROI (region of interest) and execute OCR
-    roi = crop_roi(img_col, row)
+  # The registers replayed from the journal are not new
+  batch_annuary_data.pop_added_ids()
+
+def process_batch_file(image_path):
+
+  start_page(image_path)
+  reading_errors = read_image(image_path, batch_annuary_data, batch_args)
+  end_page()
+
+  # The workers exit without printing the cache stats
+  flush_ocr_cache()
+
+  if reading_errors == None:
+    reading_errors = []
+
+  if batch_args.defer_errors:
+    queue_reading_errors(reading_errors, image_path, batch_args)
+    reading_errors = []
+
+  # Return only the registers added by this worker, a database already shares them
+  added_ids = batch_annuary_data.pop_added_ids()
+  if is_sqlite_path(batch_args.output):
+    added_ids = []
+
+  registers = [batch_annuary_data.data[num_id] for num_id in added_ids]
+
+  return (registers, reading_errors)
+
+def print_page_missings(readed_ids, annuary_data):
+  if len(readed_ids) == 0:
+    return
+
+  # IDs inside the page range that are not stored, probably skipped rows
+  start_id = min(readed_ids)
+  stop_id = max(readed_ids) + 1
+
+  missing = annuary_data.missing_ids(start_id, stop_id)
+  if len(missing) > 0:
+    print('Missing IDs between ' + str(start_id) + ' and ' + str(stop_id - 1) + ': ' + str(missing.tolist()))
 
-    readed = pytesseract.image_to_string(roi)
+def read_col_rows(img_col, args):
+
+  # Get rows
+  with timed('rows'):
+    rows = find_rows_on_annuary(img_col, args)
+
+  # Get ROIs (regions of interest) and execute OCR over all of them at once
+  rois = [crop_roi(img_col, row) for row in rows]
+  readeds = ocr_images_to_strings(rois)
+
+  return (img_col, rows, readeds)
+
+def process_rows(img_col, rows, readeds, annuary_data, args, readed_ids):
+
+  reading_errors = []
+
+  for row, readed in zip(rows, readeds):
     register_str = readed.encode('utf-8')
 
     # Parser and catch errors
     try:
-      register = parse_annuary_register_str(register_str)
+      with timed('parse'):
+        register = parse_annuary_register_str(register_str)
+
       added = annuary_data.add_register(register)
+      readed_ids.append(register['num_id'])
 
       if added:
         print('Added register: ' + str(register))
     except Exception as exception:
-      reading_errors.append((img_col, row, exception))
+      count('parse_failures')
+      reading_errors.append(create_reading_error(img_col, row, register_str, exception))
     
   return reading_errors
 
+def create_reading_error(img_col, row, register_str, exception):
+
+  # Only the row as PNG and the exception fields, the column is not kept alive
+  return {
+    'row'          : row,
+    'image'        : encode_png(crop_roi(img_col, row)),
+    'register_str' : register_str,
+    'message'      : str(exception),
+    'error_code'   : getattr(exception, 'error_code', None)
+  }
+
+def queue_reading_errors(reading_errors, image_path, args):
+  review_queue = ReviewQueue(args.review_dir)
+
+  for reading_error in reading_errors:
+    entry = dict(reading_error)
+    image = entry.pop('image')
+
+    entry['kind'] = 'annuary_row'
+    entry['image_path'] = image_path
+    review_queue.add(entry, { 'row': decode_png(image) })
+
+  print('Queued ' + str(len(reading_errors)) + ' errors to review.')
+
+def review_errors(args, annuary_data):
+  review_queue = ReviewQueue(args.review_dir)
+
+  entries = [entry for entry in review_queue.entries() if entry['kind'] == 'annuary_row']
+  print('\nThere are ' + str(len(entries)) + ' errors to review.')
+
+  # Fix with the same path of the inline errors
+  for entry in entries:
+    roi = review_queue.load_image(entry, 'row')
+
+    print('\nFile: ' + entry['image_path'] + ', readed: ' + entry['register_str'])
+
+    reading_error = dict(entry)
+    reading_error['image'] = encode_png(roi)
+    user_fix_error(reading_error, annuary_data)
+    review_queue.mark_done(entry)
+
 def fix_reading_errors(reading_errors, annuary_data):
   print('\nPlease, help me to fix the following errors (● ω ●):')
 
@@ -83,17 +246,17 @@ def fix_reading_errors(reading_errors, annuary_data):
     user_fix_error(reading_error, annuary_data)
 
 def user_fix_error(reading_error, annuary_data):
-  img_col, row, exception = reading_error
-  print('\n' + str(exception))
+  print('\n' + reading_error['message'])
 
   # Get ROI image and display
-  roi = crop_roi(img_col, row)
+  roi = decode_png(reading_error['image'])
   cv2.imshow('Bad readed row', roi)
   cv2.waitKey(0)
 
   # Wait user input and destroy the window
   user_input = raw_input('Enter the fixed register: ')
   cv2.destroyAllWindows()
+  count('interventions')
 
   # Try to parse user input and catch errors to try again 
   try:
@@ -121,27 +284,105 @@ def main():
 
   # Config parser
   parser = argparse.ArgumentParser(description='A digitalization of annuary section from Francois-Xavier Guerra database.')
-  parser.add_argument('-i', '--input', help='Input image file')
-  parser.add_argument('-o', '--output', help='Output CSV file', default='csv/annuary.csv')
+  parser.add_argument('-i', '--input', help='Input image file, directory or glob pattern')
+  parser.add_argument('-o', '--output', help='Output CSV file, or SQLite database with .sqlite or .db extension', default='csv/annuary.csv')
   parser.add_argument('-d', '--debug', help='Enable debug option', action='store_true')
   parser.add_argument('-s', '--status', help='Show status from output', action='store_true')
+  parser.add_argument('--import-csv', help='Add the registers of this CSV file to the output')
+  parser.add_argument('--export-csv', help='Write the registers of the output to this CSV file')
+  parser.add_argument('-r', '--review', help='Review the queued errors', action='store_true')
+  parser.add_argument('--defer-errors', help='Queue the errors to review later instead of asking', action='store_true')
+  parser.add_argument('--review-dir', help='Directory of the errors review queue', default=DEFAULT_REVIEW_DIR)
+  parser.add_argument('--detector', help='Columns and rows detector, projection uses ink profiles instead of contours', choices=ANNUARY_DETECTORS, default='contours')
+  parser.add_argument('-j', '--jobs', help='Number of worker processes on batch mode', type=int, default=multiprocessing.cpu_count())
+  parser.add_argument('--ocr-engine', help='OCR backend, tesserocr keeps one Tesseract loaded per worker', choices=OCR_BACKENDS, default='auto')
+  parser.add_argument('--stream', help='Binarize and find the columns strip by strip, uncompressed TIFF scans are decoded strip by strip too and the others whole', action='store_true')
+  parser.add_argument('--col-threads', help='Read the columns of a page on this number of threads', type=int, default=1)
+  parser.add_argument('--ocr-threads', help='Concurrent OCR calls inside a page, all the cores on a single page and one on batch mode by default', type=int)
+  parser.add_argument('--cache-dir', help='Directory of the OCR results cache', default=DEFAULT_CACHE_DIR)
+  parser.add_argument('--cache-size', help='Max size in MB of the OCR results cache', type=int, default=DEFAULT_CACHE_SIZE / (1024 * 1024))
+  parser.add_argument('--no-cache', help='Disable the OCR results cache', action='store_true')
+  parser.add_argument('--metrics', help='Append per page stage timings and counters to this file, JSON lines or CSV by extension')
+  parser.add_argument('--ocr-recording', help='Record the OCR results on this file, or read them from it with --ocr-engine replay')
 
   args = parser.parse_args()
 
-  if (not args.input) and (not args.status):
+  if (not args.input) and (not args.status) and (not args.review) and (not args.import_csv) and (not args.export_csv):
     print('error: argument -i/--input is required')
     return
   
   print_welcome_message()
+
+  # The pool of workers already keeps all the cores busy on batch mode
+  if args.ocr_threads == None:
+    args.ocr_threads = 1 if (args.input and is_batch_input(args.input)) else multiprocessing.cpu_count()
+
+  # Every column thread and batch worker makes its own OCR calls
+  ocr_callers = args.col_threads
+  if args.input and is_batch_input(args.input):
+    ocr_callers *= args.jobs
+
+  try:
+    set_ocr_backend(args.ocr_engine)
+    set_ocr_recording(args.ocr_recording)
+    set_ocr_concurrency(args.ocr_threads, ocr_callers)
+  except ValueError as exception:
+    print('error: ' + str(exception))
+    return
+
+  if not args.no_cache:
+    set_ocr_cache(args.cache_dir, args.cache_size * 1024 * 1024)
+
+  set_metrics_output(args.metrics)
   
-  annuary_data = AnnuaryData(args.output)
+  annuary_data = open_annuary_data(args.output)
 
   if args.status:
     annuary_data.print_status()
     return
-  
-  process_image(args, annuary_data)
-  annuary_data.save(args.output)
+
+  # Move the registers between the CSV and the SQLite storages
+  if args.import_csv:
+    annuary_data.import_csv(args.import_csv)
+    annuary_data.save()
+    return
+
+  if args.export_csv:
+    annuary_data.export_csv(args.export_csv)
+    return
+
+  if args.review:
+    start_page('review')
+    try:
+      review_errors(args, annuary_data)
+    except KeyboardInterrupt:
+      pass
+
+    end_page()
+
+    annuary_data.save()
+    return
+
+  if args.defer_errors:
+    args.debug = False
+
+  # The debug windows show whole pages
+  if args.stream:
+    args.debug = False
+
+  if is_batch_input(args.input):
+    args.debug = False
+    process_batch(args, annuary_data)
+  else:
+    start_page(args.input)
+    process_image(args, annuary_data)
+    end_page()
+
+  annuary_data.save()
+
+  ocr_cache = get_ocr_cache()
+  if ocr_cache:
+    ocr_cache.print_stats()
 
 if __name__ == '__main__':
 
@@ -0,0 +1,131 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Microbenchmark of the char rects filters of the diary structure detector.
+# The rect lists are recorded from the content rows of the diary images.
+# Run it from the root of the project:
+#
+#   $ python benchmarks/bench_char_rects.py [images/diary/393.jpg ...]
+
+import glob
+import os
+import sys
+import timeit
+import cv2
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from src import crop_roi, fix_image_rotation, binarize_image, find_columns_on_diary, \
+                find_blocks_on_diary_col, find_diary_content_rows, find_char_rects, \
+                remove_inner_rects, merge_overlays_and_brokens, merge_rects
+
+PAGE_ROI = (100, 200, 3400, 4650)
+DEFAULT_IMAGES = 'images/diary/*.jpg'
+MAX_IMAGES = 3
+REPETITIONS = 5
+
+def is_rect_inside_another_range(rect, rects):
+
+  # Previous implementation: membership on range lists
+  x_a, y_a, w_a, h_a = rect
+
+  for another_rect in rects:
+    x_b, y_b, w_b, h_b = another_rect
+    range_x = range(x_b, x_b + w_b)
+
+    if (x_a in range_x) and ((x_a + w_a) in range_x):
+      return True
+
+  return False
+
+def are_rects_overlaped_range(rect_a, rect_b):
+  range_x = range(rect_a[0], rect_a[0] + rect_a[2])
+
+  return (rect_b[0] in range_x) or ((rect_b[0] + rect_b[2]) in range_x)
+
+def merge_overlays_and_brokens_range(rects):
+
+  merged_rects = []
+
+  current = None
+  for rect in rects:
+    if not current:
+      current = rect
+      continue
+
+    if are_rects_overlaped_range(current, rect):
+      current = merge_rects(current, rect)
+      continue
+
+    curr_w = current[2]
+    x_space = rect[0] - (current[0] + curr_w)
+    if (curr_w < 14) and (x_space <= 7):
+      current = merge_rects(current, rect)
+      continue
+
+    merged_rects.append(current)
+    current = rect
+
+  if current:
+    merged_rects.append(current)
+
+  return merged_rects
+
+def filter_rects_range(rects):
+  rects = [rect for rect in rects if not is_rect_inside_another_range(rect, rects)]
+  rects.sort(key=lambda rect:rect[0])
+  return merge_overlays_and_brokens_range(rects)
+
+def filter_rects_sweep(rects):
+  rects = remove_inner_rects(rects)
+  rects.sort(key=lambda rect:rect[0])
+  return merge_overlays_and_brokens(rects)
+
+def record_rect_lists(image_paths):
+  rect_lists = []
+
+  for image_path in image_paths:
+    image_src = cv2.imread(image_path)
+    if image_src is None:
+      print('Can not read: ' + image_path)
+      continue
+
+    image_src = crop_roi(image_src, PAGE_ROI)
+    image_src = fix_image_rotation(image_src)
+    binary_image = binarize_image(image_src)
+
+    for col in find_columns_on_diary(binary_image, False):
+      img_col = crop_roi(binary_image, col)
+
+      for block in find_blocks_on_diary_col(img_col, False):
+        if block[1] == None:
+          continue
+
+        content_img = crop_roi(img_col, block[1])
+
+        for row in find_diary_content_rows(content_img, False):
+          rect_lists.append(find_char_rects(crop_roi(content_img, row)))
+
+  return rect_lists
+
+def main():
+  image_paths = sys.argv[1:]
+  if len(image_paths) == 0:
+    image_paths = sorted(glob.glob(DEFAULT_IMAGES))[:MAX_IMAGES]
+
+  rect_lists = record_rect_lists(image_paths)
+  num_rects = sum(len(rects) for rects in rect_lists)
+
+  # Both implementations must agree
+  for rects in rect_lists:
+    assert filter_rects_range(list(rects)) == filter_rects_sweep(list(rects)), rects
+
+  range_time = min(timeit.repeat(lambda: [filter_rects_range(list(r)) for r in rect_lists], number=1, repeat=REPETITIONS))
+  sweep_time = min(timeit.repeat(lambda: [filter_rects_sweep(list(r)) for r in rect_lists], number=1, repeat=REPETITIONS))
+
+  print('Rows: ' + str(len(rect_lists)) + ', rects: ' + str(num_rects))
+  print('Range lists:    %.3f ms/page' % (range_time * 1e3 / len(image_paths)))
+  print('Interval sweep: %.3f ms/page' % (sweep_time * 1e3 / len(image_paths)))
+  print('Speedup: %.1fx' % (range_time / sweep_time))
+
+if __name__ == '__main__':
+  main()
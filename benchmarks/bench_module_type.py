@@ -0,0 +1,80 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Microbenchmark of DiaryModuleParser.get_module_type over the modules of
+# csv/diary.csv. Run it from the root of the project:
+#
+#   $ python benchmarks/bench_module_type.py
+
+import csv
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from src import DiaryModuleParser
+
+REPETITIONS = 20
+
+def get_module_type_chain(module_str):
+
+  # Previous implementation: rewrites and a scan over MODULE_ZONES
+  if module_str.startswith('8'):
+    module_str = 'B' + module_str[1:]
+
+  if module_str.startswith('O') or module_str.startswith('0'):
+    module_str = 'D' + module_str[1:]
+
+  if module_str.startswith('B1'):
+    module_str = 'BI' + module_str[2:]
+
+  if module_str.startswith('88'):
+    module_str = 'BB' + module_str[2:]
+
+  if module_str.startswith('55'):
+    module_str = 'SS' + module_str[2:]
+
+  if module_str.startswith('05') or module_str.startswith('O5'):
+    module_str = 'DS' + module_str[2:]
+
+  for module_type in DiaryModuleParser.MODULE_ZONES:
+    if module_str.startswith(module_type):
+      return module_type
+
+  return None
+
+def load_module_strs(csvpath):
+  module_strs = []
+
+  with open(csvpath, 'rb') as csvfile:
+    diary_reader = csv.DictReader(csvfile, delimiter=',', quotechar="'", quoting=csv.QUOTE_NONNUMERIC)
+    for register in diary_reader:
+      module_strs.append(register['module'].replace('|', ''))
+
+  # Add the OCR confusions seen on the headers
+  for module_str in list(module_strs):
+    if module_str.startswith('B'):
+      module_strs.append('8' + module_str[1:])
+    if module_str.startswith('D'):
+      module_strs.append('0' + module_str[1:])
+
+  return module_strs
+
+def main():
+  module_strs = load_module_strs('csv/diary.csv')
+  parser = DiaryModuleParser(None)
+
+  # Both implementations must agree
+  for module_str in module_strs:
+    assert parser.get_module_type(module_str) == get_module_type_chain(module_str), module_str
+
+  chain_time = min(timeit.repeat(lambda: [get_module_type_chain(s) for s in module_strs], number=1, repeat=REPETITIONS))
+  trie_time = min(timeit.repeat(lambda: [parser.get_module_type(s) for s in module_strs], number=1, repeat=REPETITIONS))
+
+  print('Modules: ' + str(len(module_strs)))
+  print('Rewrites and scan: %.3f us/module' % (chain_time * 1e6 / len(module_strs)))
+  print('Prefix trie:       %.3f us/module' % (trie_time * 1e6 / len(module_strs)))
+  print('Speedup: %.1fx' % (chain_time / trie_time))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Microbenchmark of the large kernel morphology of the layout detection,
+# cv2 filters against src/morphology.py for each call site. Run it from the
+# root of the project:
+#
+#   $ python benchmarks/bench_morphology.py [annuary_image diary_image]
+
+import os
+import sys
+import timeit
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from src import PageContext, crop_roi, find_columns_on_diary, find_blocks_on_diary_col, \
+                dilate_rect, close_rect, SKEW_REDUCED_THRESHOLD
+
+ANNUARY_PAGE_ROI = (80, 0, 3350, 5220)
+DIARY_PAGE_ROI = (100, 200, 3400, 4650)
+ANNUARY_COL_ROI = (134, 885, 1035, 2035)
+
+DEFAULT_ANNUARY_IMAGE = 'images/annuary/384.jpg'
+DEFAULT_DIARY_IMAGE = 'images/diary/393.jpg'
+REPETITIONS = 5
+
+def load_binary(image_path, page_roi):
+  page = PageContext(image_path, page_roi)
+  if not page.load():
+    print('Can not read: ' + image_path)
+    sys.exit(1)
+
+  return page
+
+def get_call_sites(annuary_path, diary_path):
+  annuary_page = load_binary(annuary_path, ANNUARY_PAGE_ROI)
+  annuary_binary = annuary_page.get_binary()
+
+  diary_page = load_binary(diary_path, DIARY_PAGE_ROI)
+  diary_page.deskew()
+  diary_binary = diary_page.get_binary()
+
+  # Inputs of each call site as the detectors get them
+  diary_col = crop_roi(diary_binary, find_columns_on_diary(diary_binary, False)[0])
+  blocks = [block for block in find_blocks_on_diary_col(diary_col, False) if block[1] != None]
+  diary_content = crop_roi(diary_col, blocks[0][1])
+
+  height, width = diary_page.gray.shape[:2]
+  reduced = cv2.resize(diary_page.gray, (width // 2, height // 2), interpolation=cv2.INTER_AREA)
+  reduced = cv2.threshold(reduced, SKEW_REDUCED_THRESHOLD, 255, cv2.THRESH_BINARY_INV)[1]
+
+  annuary_col = crop_roi(annuary_binary, ANNUARY_COL_ROI)
+
+  return [
+    ('get_level_angle_rotation',  reduced,        'close',  (37, 75)),
+    ('find_col_strips_by_contours', annuary_binary, 'dilate', (60, 25)),
+    ('find_row_bands_by_contours',  annuary_col,    'dilate', (1, 50)),
+    ('find_row_bands_by_contours',  annuary_col,    'close',  (1, 180)),
+    ('find_columns_on_diary',     diary_binary,   'close',  (40, 85)),
+    ('find_blocks_on_diary_col',  diary_col,      'close',  (2, 200)),
+    ('find_diary_content_rows',   diary_content,  'close',  (5, diary_content.shape[1]))
+  ]
+
+def cv2_morphology(img, operation, size):
+  kernel = np.ones(size, np.uint8)
+  if operation == 'dilate':
+    return cv2.dilate(img, kernel)
+
+  return cv2.morphologyEx(img, cv2.MORPH_CLOSE, kernel)
+
+def helper_morphology(img, operation, size):
+  if operation == 'dilate':
+    return dilate_rect(img, size)
+
+  return close_rect(img, size)
+
+def main():
+  annuary_path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_ANNUARY_IMAGE
+  diary_path = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_DIARY_IMAGE
+
+  for name, img, operation, size in get_call_sites(annuary_path, diary_path):
+
+    # Both implementations must agree
+    expected = cv2_morphology(img, operation, size)
+    assert (expected == helper_morphology(img, operation, size)).all(), name
+
+    cv2_time = min(timeit.repeat(lambda: cv2_morphology(img, operation, size), number=1, repeat=REPETITIONS))
+    helper_time = min(timeit.repeat(lambda: helper_morphology(img, operation, size), number=1, repeat=REPETITIONS))
+
+    print('%-28s %-6s %-11s %5dx%-5d cv2 %7.2f ms  helper %7.2f ms  %.1fx' % (
+      name, operation, str(size), img.shape[0], img.shape[1],
+      cv2_time * 1e3, helper_time * 1e3, cv2_time / helper_time))
+
+if __name__ == '__main__':
+  main()
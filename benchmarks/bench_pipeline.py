@@ -0,0 +1,221 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# End to end benchmark of both pipelines over synthetic pages. Renders the
+# pages with src/synthetic_pages.py, runs the scripts headless (deferred
+# errors, no OCR cache) and compares the CSV output with the ground truth.
+# Run it from the root of the project:
+#
+#   $ python benchmarks/bench_pipeline.py --pages 4 --jobs 4
+#
+# The OCR results can be recorded once and replayed on the next runs, to
+# measure the image and parsing code without Tesseract:
+#
+#   $ python benchmarks/bench_pipeline.py --record recordings/
+#   $ python benchmarks/bench_pipeline.py --replay recordings/
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from src.synthetic_pages import generate_annuary_pages, generate_diary_pages
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+PIPELINES = [ 'annuary', 'diary' ]
+ANNUARY_FIELDS = [ 'text_id', 'name', 'type', 'info' ]
+
+def run_command(command, logpath):
+
+  # On a fresh process, its children are only the pipeline ones
+  with open(logpath, 'wb') as logfile, open(os.devnull, 'rb') as devnull:
+    returncode = subprocess.call(command, cwd=ROOT_DIR, stdin=devnull, stdout=logfile, stderr=subprocess.STDOUT)
+
+  return (returncode, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+def run_pipeline(kind, workdir, args):
+  pages_dir = os.path.join(workdir, kind)
+  output_path = os.path.join(workdir, kind + '.csv')
+  metrics_path = os.path.join(workdir, kind + '_metrics.jsonl')
+
+  command = [ sys.executable, kind + '_ocr.py', '-i', pages_dir, '-o', output_path,
+              '-j', str(args.jobs), '--ocr-engine', 'replay' if args.replay else args.ocr_engine, '--no-cache', '--defer-errors',
+              '--review-dir', os.path.join(workdir, kind + '_review'), '--metrics', metrics_path ]
+
+  if kind == 'annuary':
+    command += [ '--detector', args.detector ]
+
+  if args.stream:
+    command += [ '--stream' ]
+
+  # Start a new recording instead of appending to the last one
+  if args.record:
+    recording_path = get_recording_path(args.record, kind)
+    if os.path.exists(recording_path):
+      os.remove(recording_path)
+
+    command += [ '--ocr-recording', recording_path ]
+  elif args.replay:
+    command += [ '--ocr-recording', get_recording_path(args.replay, kind) ]
+
+  if kind == 'diary':
+    annuary_path = os.path.join(workdir, 'diary_annuary.csv')
+    shutil.copy(os.path.join(pages_dir, 'references.csv'), annuary_path)
+    command += [ '-a', annuary_path ]
+
+  pool = multiprocessing.Pool(1)
+  start = time.time()
+  returncode, max_rss = pool.apply(run_command, (command, os.path.join(workdir, kind + '.log')))
+  duration = time.time() - start
+  pool.close()
+  pool.join()
+
+  if returncode != 0:
+    print('Pipeline ' + kind + ' failed, see ' + os.path.join(workdir, kind + '.log'))
+    sys.exit(1)
+
+  return (duration, max_rss)
+
+def get_recording_path(recording_dir, kind):
+  return os.path.abspath(os.path.join(recording_dir, kind + '.jsonl'))
+
+def read_csv(csvpath):
+  if not os.path.exists(csvpath):
+    return []
+
+  with open(csvpath, 'rb') as csvfile:
+    return list(csv.DictReader(csvfile, delimiter=',', quotechar="'", quoting=csv.QUOTE_NONNUMERIC))
+
+def read_annuary(csvpath):
+  return dict((int(register['num_id']), register) for register in read_csv(csvpath))
+
+def read_diary(csvpath):
+  modules = {}
+  for register in read_csv(csvpath):
+    modules.setdefault(int(register['annuary_id']), []).append(register['module'])
+
+  return modules
+
+def count_ocr_calls(metrics_path):
+  ocr_calls = 0
+  with open(metrics_path, 'rb') as metrics_file:
+    for line in metrics_file:
+      record = json.loads(line)
+      if record['image'] != 'review':
+        ocr_calls += record['counters']['ocr_calls']
+
+  return ocr_calls
+
+def compare_registers(expected, readed):
+  if readed == None:
+    return (0, len(ANNUARY_FIELDS))
+
+  matched = sum(1 for field in ANNUARY_FIELDS if expected[field] == readed[field])
+  return (matched, len(ANNUARY_FIELDS))
+
+def compare_modules(expected, readed):
+  matched = 0
+  total = 0
+
+  # Module by module and zone by zone, in reading order
+  for i, module in enumerate(expected):
+    zones = module.split('|')
+    readed_zones = readed[i].split('|') if i < len(readed) else []
+
+    total += len(zones)
+    matched += sum(1 for j, zone in enumerate(zones) if (j < len(readed_zones)) and (zone == readed_zones[j]))
+
+  return (matched, total)
+
+def get_annuary_accuracy(truth, workdir):
+  readed = read_annuary(os.path.join(workdir, 'annuary.csv'))
+
+  matched = 0
+  total = 0
+  for page in truth['pages']:
+    for register in page['registers']:
+      page_matched, page_total = compare_registers(register, readed.get(register['num_id']))
+      matched += page_matched
+      total += page_total
+
+  return (matched, total)
+
+def get_diary_accuracy(truth, workdir):
+  readed_headers = read_annuary(os.path.join(workdir, 'diary_annuary.csv'))
+  readed_modules = read_diary(os.path.join(workdir, 'diary.csv'))
+
+  matched = 0
+  total = 0
+  for page in truth['pages']:
+    for block in page['blocks']:
+      header = block['header']
+      header_matched, header_total = compare_registers(header, readed_headers.get(header['num_id']))
+      modules_matched, modules_total = compare_modules(block['modules'], readed_modules.get(header['num_id'], []))
+
+      matched += header_matched + modules_matched
+      total += header_total + modules_total
+
+  return (matched, total)
+
+def bench_pipeline(kind, workdir, args):
+  pages_dir = os.path.join(workdir, kind)
+
+  # Render the pages with the same seed on every run
+  if kind == 'annuary':
+    truth = generate_annuary_pages(pages_dir, args.pages, args.seed)
+  else:
+    truth = generate_diary_pages(pages_dir, args.pages, args.seed)
+
+  duration, max_rss = run_pipeline(kind, workdir, args)
+
+  if kind == 'annuary':
+    matched, total = get_annuary_accuracy(truth, workdir)
+  else:
+    matched, total = get_diary_accuracy(truth, workdir)
+
+  ocr_calls = count_ocr_calls(os.path.join(workdir, kind + '_metrics.jsonl'))
+
+  print('%-8s %3d pages %8.2f s %6.3f pages/s %7.1f OCR calls/page  peak RSS %6.1f MB  accuracy %5.1f%% (%d/%d fields)' % (
+    kind, args.pages, duration, args.pages / duration, ocr_calls / float(args.pages),
+    max_rss / 1024.0, (100.0 * matched) / max(total, 1), matched, total))
+
+def main():
+  parser = argparse.ArgumentParser(description='End to end benchmark over synthetic pages.')
+  parser.add_argument('-n', '--pages', help='Number of pages by pipeline', type=int, default=4)
+  parser.add_argument('-j', '--jobs', help='Number of worker processes', type=int, default=multiprocessing.cpu_count())
+  parser.add_argument('--seed', help='Seed of the synthetic pages', type=int, default=0)
+  parser.add_argument('--pipeline', help='Pipeline to run, both by default', choices=PIPELINES)
+  parser.add_argument('--ocr-engine', help='OCR backend of the pipelines', default='auto')
+  parser.add_argument('--detector', help='Columns and rows detector of the annuary', default='contours')
+  parser.add_argument('--stream', help='Run the pipelines strip by strip', action='store_true')
+  parser.add_argument('--workdir', help='Keep pages, outputs and logs on this directory')
+  parser.add_argument('--record', help='Record the OCR results of the pipelines on this directory')
+  parser.add_argument('--replay', help='Replay the OCR results recorded on this directory, with the same pages and seed')
+
+  args = parser.parse_args()
+
+  if args.record and args.replay:
+    print('error: --record and --replay can not be used together')
+    return
+
+  workdir = args.workdir or tempfile.mkdtemp(prefix='bench_pipeline_')
+  workdir = os.path.abspath(workdir)
+
+  try:
+    for kind in PIPELINES:
+      if (args.pipeline == None) or (args.pipeline == kind):
+        bench_pipeline(kind, workdir, args)
+  finally:
+    if not args.workdir:
+      shutil.rmtree(workdir, True)
+
+if __name__ == '__main__':
+  main()
@@ -4,34 +4,70 @@
 # Import dependencies
 import pytesseract
 import argparse
+import multiprocessing
 import cv2
 import numpy as np
 import os
 import readline
 import math
-from src import AnnuaryData, DiaryData, crop_roi, show_scaled_image, \
-                fix_image_rotation, binarize_image, find_columns_on_diary, \
-                find_blocks_on_diary_col, parse_annuary_register_str, \
+from src import open_annuary_data, open_diary_data, crop_roi, show_scaled_image, \
+                find_columns_on_diary, find_blocks_on_diary_col, parse_annuary_register_str, \
                 get_diary_content_rows, AnnuaryParsingException, \
                 get_tesseract_cmd, parse_num_id_only, DiaryModuleParser, \
-                DiaryParsingException, draw_boxes
+                DiaryParsingException, draw_boxes, is_batch_input, \
+                get_input_files, set_ocr_backend, \
+                OCR_BACKENDS, ocr_image_to_lines, stack_images, set_ocr_cache, \
+                get_ocr_cache, DEFAULT_CACHE_DIR, DEFAULT_CACHE_SIZE, ReviewQueue, \
+                AnnuaryParsingException, CatalogsData, PageContext, set_metrics_output, \
+                start_page, end_page, timed, count, set_ocr_recording, \
+                set_ocr_concurrency, ocr_images_to_strings, ordered_thread_map, \
+                flush_ocr_cache, is_sqlite_path
 
 import time
 
+BATCH_TIMEOUT = 60 * 60 * 24 * 7
+DEFAULT_REVIEW_DIR = 'review/diary'
+
+class DeferredFix(Exception):
+
+  def __init__(self, fix):
+    Exception.__init__(self, fix['kind'])
+    self.fix = fix
+
 class DiaryOCR:
 
   PAGE_ROI = (100, 200, 3400, 4650)
   SPACE_CHAR = '_'
 
-  def __init__(self, args):
-    self.annuary_data = AnnuaryData(args.annuary)
-    self.diary_data = DiaryData(args.output)
+  HEADER_WHITELIST = '-c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-+*.()'
+  HEADER_MOSAIC_PADDING = 20
+
+  def __init__(self, args, journaled=True):
+    self.annuary_data = open_annuary_data(args.annuary, journaled)
+    self.diary_data = open_diary_data(args.output, journaled)
 
     self.module_parser = DiaryModuleParser(self.annuary_data)
 
     self.input_path = args.input
     self.debug = args.debug
 
+    # The debug windows can not be shown from the column threads
+    self.col_threads = 1 if args.debug else args.col_threads
+
+    # Deskew only the crops readed by the OCR
+    self.deskew_crops = args.deskew_crops
+    self.page = None
+
+    # Deskew and binarize strip by strip, without whole page copies
+    self.stream = args.stream
+
+    # On deferred mode the fixes are stored as pending blocks
+    self.defer_fixes = False
+    self.pending_blocks = []
+    self.current_col = None
+    self.current_col_roi = None
+    self.stored_content_ids = None
+
   def start(self):
 
     if not os.path.exists(self.input_path):
@@ -40,49 +76,135 @@ class DiaryOCR:
 
     print('\nProcessing file ' + self.input_path + '...')
 
-    # Read image source and crop it
-    image_src = cv2.imread(self.input_path)
-    image_src = crop_roi(image_src, DiaryOCR.PAGE_ROI)
-    image_src = fix_image_rotation(image_src)
+    # Read image source as grayscale and crop it, whole for the deskewed crops
+    self.page = PageContext(self.input_path, DiaryOCR.PAGE_ROI)
+    if not self.page.load(self.stream and (not self.deskew_crops)):
+      print('\nError on reading or file input dont exist. ( ∩ ︵ ∩ )')
+      return
+
+    if (not self.deskew_crops) and (not self.stream):
+      self.page.deskew()
+
     if self.debug:
-      show_scaled_image('source', image_src, 0.4)
+      show_scaled_image('source', self.page.gray, 0.4)
     
-    # Get binary image
-    binary_image = binarize_image(image_src)
+    # Get binary image, the deskewed crops still read the gray page
+    if self.stream:
+      binary_image = self.page.get_strip_binary(True, self.deskew_crops)
+      if not self.deskew_crops:
+        self.page.release_gray()
+    elif self.deskew_crops:
+      binary_image = self.page.get_layout_binary()
+    else:
+      binary_image = self.page.get_binary()
+
     if self.debug:
       show_scaled_image('binary', binary_image, 0.4)
     
     # Get columns
-    cols = find_columns_on_diary(binary_image, self.debug)
+    with timed('columns'):
+      cols = find_columns_on_diary(binary_image, self.debug)
     print('Detected ' + str(len(cols)) + ' columns.')
 
+    # The column threads look up the contents stored before the page, this one stores the new ones
+    self.stored_content_ids = None
+    if self.col_threads > 1:
+      self.stored_content_ids = self.diary_data.stored_annuary_ids()
+
+    # Read the columns on threads, merge them in order on this one
+    read_col = lambda col: self.read_col(crop_roi(binary_image, col), col)
+    col_readings = ordered_thread_map(read_col, cols, self.col_threads)
+
     # Process each column
-    for i in range(len(cols)):
+    for i, col_reading in enumerate(col_readings):
       print('\nProcessing ' + str(i + 1) + '/' + str(len(cols)) + ' column...')
+      self.current_col = i
+      self.current_col_roi = cols[i]
 
       img_col = crop_roi(binary_image, cols[i])
-      self.process_col(img_col)
+      self.process_col(img_col, col_reading)
+
+    self.stored_content_ids = None
+
+    self.annuary_data.checkpoint()
+    self.diary_data.checkpoint()
+
+  def crop_for_ocr(self, img, roi, offset):
+
+    # Without rotation (or without page) the crop is already deskewed
+    if (offset == None) or (not self.deskew_crops) or (self.page.get_rotation_matrix() is None):
+      return crop_roi(img, roi)
+
+    x, y, w, h = roi
+    return self.page.get_deskewed_crop((offset[0] + x, offset[1] + y, w, h))
   
-  def process_col(self, img_col):
+  def read_col(self, img_col, col_roi):
 
     if self.debug:
       show_scaled_image('col', img_col, 0.4)
     
     # Find blocks from the column
-    blocks = find_blocks_on_diary_col(img_col, self.debug)
+    with timed('blocks'):
+      blocks = find_blocks_on_diary_col(img_col, self.debug)
+
+    # Read all the headers at once
+    headers_str = self.read_headers(img_col, blocks, col_roi)
+
+    # Read the contents, without parsing them nor touching the data
+    contents = []
+    for block, header_str in zip(blocks, headers_str):
+      contents.append(self.read_block_content(img_col, block, header_str, col_roi))
+
+    return (blocks, headers_str, contents)
+
+  def read_block_content(self, img_col, block, header_str, col_roi):
+
+    # Prevent repeat work, the content is checked again on processing
+    if (block[1] == None) or self.is_content_stored(header_str):
+      return None
+
+    content_img = crop_roi(img_col, block[1])
+    if self.debug:
+      show_scaled_image('content', content_img, 1.0)
+
+    with timed('rows'):
+      content_rows = get_diary_content_rows(content_img, self.debug)
+
+    rows_str = self.read_content_rows_str(content_img, content_rows, self.get_block_offset(col_roi, block[1]))
+
+    return (content_rows, rows_str)
+
+  def is_content_stored(self, header_str):
+    try:
+      annuary_id = parse_num_id_only(header_str)
+    except Exception as exception:
+      return False
+
+    if self.stored_content_ids != None:
+      return annuary_id in self.stored_content_ids
+
+    stored_content = self.diary_data.search_by_annuary_id(annuary_id)
+    return (stored_content != None) and (len(stored_content) > 0)
+
+  def process_col(self, img_col, col_reading):
+    blocks, headers_str, contents = col_reading
     print('  Detected ' + str(len(blocks)) + ' blocks.')
 
     # Process each block
-    for block in blocks:
-      self.process_block(img_col, block)
+    for block, header_str, content in zip(blocks, headers_str, contents):
+      self.process_block(img_col, block, header_str, content)
   
-  def process_block(self, img_col, block):
+  def process_block(self, img_col, block, header_str, content=None):
 
     print('\n  :::::::::')
 
     # Get header
     header_img = crop_roi(img_col, block[0])
-    header_register = self.read_header(header_img)
+    try:
+      header_register = self.process_annuary_str(header_img, header_str)
+    except DeferredFix as deferred:
+      return self.defer_block(img_col, block, deferred.fix, content)
+
     annuary_id = header_register['num_id']
 
     print('  * Annuary register: ' + str(header_register))
@@ -98,8 +220,12 @@ class DiaryOCR:
       return
     
     # Get content
-    content_img = crop_roi(img_col, block[1])
-    content = self.read_content(content_img)
+    content_rows = self.get_content_rows(img_col, block, content)
+
+    if self.has_deferred_fixes(content_rows):
+      return self.add_pending_block(block, header_register, content_rows)
+
+    content = [module for row in content_rows for module in row]
 
     # Register content
     print('  * Content: ')
@@ -107,20 +233,120 @@ class DiaryOCR:
       self.diary_data.add_module(annuary_id, module)
       print('    - ' + ''.join(module))
 
-  def read_header(self, header_img):
+  def defer_block(self, img_col, block, header_fix, content=None):
+
+    # The content can be read without knowing the header
+    content_rows = []
+    if block[1] != None:
+      content_rows = self.get_content_rows(img_col, block, content)
+
+    self.add_pending_block(block, header_fix, content_rows)
+
+  def get_content_rows(self, img_col, block, content):
+    content_img = crop_roi(img_col, block[1])
+
+    # Read now the content skipped when the column was readed
+    if content == None:
+      return self.read_content_rows(content_img, self.get_block_offset(self.current_col_roi, block[1]))
+
+    content_rows, rows_str = content
+    return self.process_content_rows(content_img, content_rows, rows_str)
+
+  def get_block_offset(self, col_roi, block_roi):
+    col_x, col_y = col_roi[:2]
+    return (col_x + block_roi[0], col_y + block_roi[1])
+
+  def add_pending_block(self, block, header, content_rows):
+    print('  * Block deferred to be fixed later.')
+    self.pending_blocks.append({
+      'image_path' : self.input_path,
+      'col'        : self.current_col,
+      'block'      : block[0],
+      'header'     : header,
+      'rows'       : content_rows
+    })
+
+  def has_deferred_fixes(self, content_rows):
+    return any(isinstance(row, dict) for row in content_rows)
+
+  def resolve_pending_block(self, pending_block):
+
+    print('\n  :::::::::')
+
+    # Fix header if was deferred
+    header = pending_block['header']
+    if header.get('kind') == 'choose_register':
+      header = self.choose_register(header['image'], header['register_a'], header['register_b'])
+    elif header.get('kind') == 'annuary_error':
+      header = self.user_fix_annuary_error(header['image'], header['exception'], header['readed_str'])
+
+    annuary_id = header['num_id']
+    print('  * Annuary register: ' + str(header))
+
+    # Check if is already readed (prevent repeat work)
+    stored_content = self.diary_data.search_by_annuary_id(annuary_id)
+    if (stored_content != None) and (len(stored_content) > 0):
+      return
+
+    # Fix content rows in order and register content
+    print('  * Content: ')
+    for row in pending_block['rows']:
+      if isinstance(row, dict):
+        row = self.user_fix_modules_error(row['image'], row['row'], row['row_str'], row['exception'], row['skipping'])
+
+      for module in row:
+        self.diary_data.add_module(annuary_id, module)
+        print('    - ' + ''.join(module))
+
+  def read_headers(self, img_col, blocks, col_roi):
+
+    if len(blocks) == 0:
+      return []
+
+    # Stack headers in a single image and execute OCR once
+    col_offset = col_roi[:2]
+    headers_img = [self.crop_for_ocr(img_col, block[0], col_offset) for block in blocks]
+    mosaic, slots = stack_images(headers_img, DiaryOCR.HEADER_MOSAIC_PADDING)
+
+    config_str = DiaryOCR.HEADER_WHITELIST + ' --psm 6'
+    lines = ocr_image_to_lines(mosaic, config=config_str)
+
+    # Map each line into its slot by the line center
+    half_padding = DiaryOCR.HEADER_MOSAIC_PADDING / 2
+    slots_lines = [[] for slot in slots]
+
+    for line_str, line_box in lines:
+      center_y = line_box[1] + (line_box[3] / 2)
+
+      for i, slot in enumerate(slots):
+        if (slot[1] - half_padding) <= center_y < (slot[1] + slot[3] + half_padding):
+          slots_lines[i].append(line_str)
+          break
+
+    # Headers without a single line are readed again one by one
+    reread = [i for i, slot_lines in enumerate(slots_lines) if len(slot_lines) != 1]
+    reread_str = self.read_headers_str([headers_img[i] for i in reread])
+
+    headers_str = [slot_lines[0].encode('utf-8') if len(slot_lines) == 1 else None for slot_lines in slots_lines]
+    for i, header_str in zip(reread, reread_str):
+      headers_str[i] = header_str
+
+    return headers_str
+
+  def read_headers_str(self, headers_img):
 
     # Execute OCR with custom config
-    config_str = '-c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-+*.() --psm 7'
-    bytes_readed = pytesseract.image_to_string(header_img, config=config_str)
-    readed_str = bytes_readed.encode('utf-8')
+    config_str = DiaryOCR.HEADER_WHITELIST + ' --psm 7'
+    readeds = ocr_images_to_strings(headers_img, config=config_str)
 
-    return self.process_annuary_str(header_img, readed_str)
+    return [readed.encode('utf-8') for readed in readeds]
 
   def process_annuary_str(self, header_img, readed_str):
 
     # Try parse header and catch errors
     try:
-      readed_register = parse_annuary_register_str(readed_str)
+      with timed('parse'):
+        readed_register = parse_annuary_register_str(readed_str)
 
       num_id = readed_register['num_id']
       annuary_register = self.annuary_data.search_by_num_id(num_id)
@@ -139,6 +365,7 @@ class DiaryOCR:
         return readed_register
 
     except AnnuaryParsingException as exception:
+      count('parse_failures')
       return self.fix_annuary_register(header_img, readed_str, exception)
   
   def are_registers_equals(self, register_a, register_b):
@@ -149,6 +376,14 @@ class DiaryOCR:
   
   def choose_register(self, header_img, register_a, register_b):
 
+    if self.defer_fixes:
+      raise DeferredFix({
+        'kind'       : 'choose_register',
+        'image'      : header_img,
+        'register_a' : register_a,
+        'register_b' : register_b
+      })
+
     # Get option from user
     print('\n  Differences were found in registers.')
     print('      1. ' + str(register_a))
@@ -159,6 +394,7 @@ class DiaryOCR:
     cv2.waitKey(0)
 
     user_input = raw_input('  Help me to choose one: ')
+    count('interventions')
     if user_input == '1':
       choosed = register_a
     else:
@@ -184,11 +420,20 @@ class DiaryOCR:
     
     user_should_fix = not annuary_register
     if user_should_fix:
-      return self.user_fix_annuary_error(header_img, exception)
+      return self.user_fix_annuary_error(header_img, exception, readed_str)
 
     return annuary_register
   
-  def user_fix_annuary_error(self, header_img, exception):
+  def user_fix_annuary_error(self, header_img, exception, readed_str=''):
+
+    if self.defer_fixes:
+      raise DeferredFix({
+        'kind'       : 'annuary_error',
+        'image'      : header_img,
+        'readed_str' : readed_str,
+        'exception'  : exception
+      })
+
     print('  ---\n  ANNUARY ERROR: ' + str(exception) + '. Help me to fix it.')
 
     # Show image
@@ -197,36 +442,68 @@ class DiaryOCR:
 
     user_input = raw_input('  Enter the fixed register: ')
     cv2.destroyAllWindows()
+    count('interventions')
 
     return self.process_annuary_str(header_img, user_input)
 
-  def read_content(self, content_img):
+  def read_content(self, content_img, offset=None):
+
+    content = []
+    for row in self.read_content_rows(content_img, offset):
+      content += row
+
+    return content
+
+  def read_content_rows(self, content_img, offset=None):
 
     if self.debug:
       show_scaled_image('content', content_img, 1.0)
     
     # Get each content row
-    content_rows = get_diary_content_rows(content_img, self.debug)
+    with timed('rows'):
+      content_rows = get_diary_content_rows(content_img, self.debug)
 
-    # Process each content row
-    content = []
-    for content_row in content_rows:
-      content += self.process_content_row(content_img, content_row)
+    # Read all the rows at once
+    rows_str = self.read_content_rows_str(content_img, content_rows, offset)
+
+    return self.process_content_rows(content_img, content_rows, rows_str)
+
+  def process_content_rows(self, content_img, content_rows, rows_str):
+
+    # Process each content row, deferred fixes are kept in its place
+    rows = []
+    for content_row, row_str in zip(content_rows, rows_str):
+      try:
+        rows.append(self.process_content_row_str(content_img, content_row['row'], row_str))
+      except DeferredFix as deferred:
+        rows.append(deferred.fix)
     
-    return content
+    return rows
 
-  def process_content_row(self, content_img, content_row):
+  def read_content_rows_str(self, content_img, content_rows, offset=None):
 
-    row_modules = content_row['modules']
-    row = content_row['row']
+    # Crop the chars of every row in reading order
+    chars_img = []
+    for content_row in content_rows:
+      row = content_row['row']
+      row_img = crop_roi(content_img, row)
+      row_offset = None if offset == None else (offset[0] + row[0], offset[1] + row[1])
 
-    # Crop and read the content
-    row_img = crop_roi(content_img, row)
-    row_str = self.read_content_row(row_img, row_modules)
+      for num_chars, char_rect in content_row['modules']:
+        if char_rect:
+          chars_img.append(self.crop_for_ocr(row_img, char_rect, row_offset))
 
-    return self.process_content_row_str(content_img, row, row_str)
+    # Execute OCR over all the chars at once
+    config_str = '-c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789= --psm 8'
+    readeds = iter(ocr_images_to_strings(chars_img, config=config_str))
 
-  def read_content_row(self, row_img, row_modules):
+    rows_str = []
+    for content_row in content_rows:
+      rows_str.append(self.join_content_row_str(content_row['modules'], readeds))
+
+    return rows_str
+
+  def join_content_row_str(self, row_modules, readeds):
     row_str = ''
 
     for content_module in row_modules:
@@ -235,16 +512,8 @@ class DiaryOCR:
       if not char_rect:
         row_str += (DiaryOCR.SPACE_CHAR * num_chars)
         continue
-      
-      # Execute OCR
-      char_img = crop_roi(row_img, char_rect)
-
-      config_str = '-c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789= --psm 8'
-      
-      bytes_readed = pytesseract.image_to_string(char_img, config=config_str)
-      readed_str = bytes_readed.encode('utf-8')
 
-      row_str += readed_str
+      row_str += next(readeds).encode('utf-8')
     
     if len(row_str) < 33:
       missing_spaces = 11 - (len(row_str) % 11)
@@ -258,8 +527,10 @@ class DiaryOCR:
     # Parse row_str into modules
     modules = self.slice_row_str(row_str)
     try:
-      parsed_modules = self.module_parser.parse_modules(modules, skipping)
+      with timed('parse'):
+        parsed_modules = self.module_parser.parse_modules(modules, skipping)
     except DiaryParsingException as exception:
+      count('parse_failures')
       return self.user_fix_modules_error(content_img, row, row_str, exception, skipping)
     
     return parsed_modules
@@ -277,6 +548,17 @@ class DiaryOCR:
     return modules
 
   def user_fix_modules_error(self, content_img, row, row_str, exception, skipping):
+
+    if self.defer_fixes:
+      raise DeferredFix({
+        'kind'      : 'modules_error',
+        'image'     : content_img,
+        'row'       : row,
+        'row_str'   : row_str,
+        'exception' : exception,
+        'skipping'  : skipping
+      })
+
     print('  ---\n  DIARY ERROR: ' + str(exception) + '. Help me to fix it.')
 
     # Show image
@@ -286,6 +568,7 @@ class DiaryOCR:
 
     user_input = raw_input(' [' + row_str + '] Enter the fixed text: ')
     cv2.destroyAllWindows()
+    count('interventions')
 
     # User try to skip the exception
     if (user_input == 'SKIP'):
@@ -310,12 +593,132 @@ class DiaryOCR:
 
     return skipping
   
+  def queue_pending_blocks(self, review_queue):
+
+    for pending_block in self.pending_blocks:
+      entry, images = encode_pending_block(pending_block)
+      review_queue.add(entry, images)
+
+    print('\nQueued ' + str(len(self.pending_blocks)) + ' blocks to review.')
+    self.pending_blocks = []
+
+  def review_errors(self, review_queue):
+
+    entries = [entry for entry in review_queue.entries() if entry['kind'] == 'diary_block']
+    print('\nThere are ' + str(len(entries)) + ' blocks to review.')
+
+    # Fix with the same path of the batch pending blocks
+    for entry in entries:
+      print('\n  File: ' + entry['image_path'] + ', column: ' + str(entry['col']) + ', block: ' + str(entry['block']))
+
+      pending_block = decode_pending_block(entry, review_queue)
+      self.resolve_pending_block(pending_block)
+      review_queue.mark_done(entry)
+
+  def merge_batch_results(self, results):
+
+    # Merge readed data in files order
+    pending_blocks = []
+    for result in results:
+      for register in result['registers']:
+        self.annuary_data.add_register(register)
+
+      for annuary_id, module in result['modules']:
+        self.diary_data.add_module(annuary_id, module)
+
+      pending_blocks += result['pending_blocks']
+
+    # Fix pending blocks with user help
+    print('\nFinished with ' + str(len(pending_blocks)) + ' blocks to fix.')
+    for pending_block in pending_blocks:
+      self.resolve_pending_block(pending_block)
+
   def save_data(self):
     print('\n\n  Saving data...')
 
     self.annuary_data.save()
     self.diary_data.save()
 
+def encode_pending_block(pending_block):
+  images = {}
+
+  entry = {
+    'kind'       : 'diary_block',
+    'image_path' : pending_block['image_path'],
+    'col'        : pending_block['col'],
+    'block'      : pending_block['block']
+  }
+
+  # Header as register or the fix to do
+  header = dict(pending_block['header'])
+  if 'kind' in header:
+    images['header'] = header.pop('image')
+    if 'exception' in header:
+      header['exception'] = encode_exception(header['exception'])
+  else:
+    header = { 'kind': 'register', 'register': header }
+
+  entry['header'] = header
+
+  # Rows as modules or the fix to do, all rows share the content image
+  entry['rows'] = []
+  for row in pending_block['rows']:
+    if not isinstance(row, dict):
+      entry['rows'].append({ 'kind': 'modules', 'modules': row })
+      continue
+
+    row = dict(row)
+    images['content'] = row.pop('image')
+    row['exception'] = encode_exception(row['exception'])
+    row['skipping'] = [encode_exception(skipped) for num_module in row['skipping'] for skipped in row['skipping'][num_module]]
+    entry['rows'].append(row)
+
+  return (entry, images)
+
+def decode_pending_block(entry, review_queue):
+
+  header = entry['header']
+  if header['kind'] == 'register':
+    header = header['register']
+  else:
+    header['image'] = review_queue.load_image(entry, 'header')
+    if 'exception' in header:
+      header['exception'] = decode_exception(header['exception'])
+
+  rows = []
+  for row in entry['rows']:
+    if row['kind'] == 'modules':
+      rows.append(row['modules'])
+      continue
+
+    row['image'] = review_queue.load_image(entry, 'content')
+    row['row'] = tuple(row['row'])
+    row['exception'] = decode_exception(row['exception'])
+
+    skipping = {}
+    for skipped in row['skipping']:
+      skipped = decode_exception(skipped)
+      skipping.setdefault(skipped.num_module, []).append(skipped)
+
+    row['skipping'] = skipping
+    rows.append(row)
+
+  return { 'header': header, 'rows': rows }
+
+def encode_exception(exception):
+  encoded = dict(exception.__dict__)
+  encoded['message'] = str(exception)
+  encoded['class'] = exception.__class__.__name__
+
+  return encoded
+
+def decode_exception(encoded):
+  if encoded['class'] == 'AnnuaryParsingException':
+    return AnnuaryParsingException(encoded['message'], encoded['error_code'])
+
+  zone = tuple(encoded['zone']) if encoded['zone'] != None else None
+  return DiaryParsingException(encoded['message'], encoded['error_code'], encoded['num_module'], zone, encoded['zone_str'])
+
 def print_welcome_message():
   print('\n:::::::::::::::::::::::::::::::::::::::::::::::::::::::::')
   print('::                      DIARY OCR                      ::')
@@ -326,44 +729,211 @@ def print_welcome_message():
   print(':: Diego Montesinos (diegomontesinos@ciencias.unam.mx) ::')
   print(':::::::::::::::::::::::::::::::::::::::::::::::::::::::::')
 
-# Main script
-def main():
+def process_batch(args):
+  image_paths = get_input_files(args.input)
+  if len(image_paths) == 0:
+    print('\nError on reading or file input dont exist. ( ∩ ︵ ∩ )')
+    return
+
+  print('\nProcessing ' + str(len(image_paths)) + ' files with ' + str(args.jobs) + ' workers...')
 
-  # Check tesseract installation
-  tesseract_cmd = get_tesseract_cmd()
-  if (not tesseract_cmd) or (tesseract_cmd == ''):
-    print('Tesseract not installed')
+  # Read all pages on the pool, each worker loads its own data once
+  pool = multiprocessing.Pool(args.jobs, init_batch_worker, (args,))
+  try:
+    results = pool.map_async(process_batch_file, image_paths, 1).get(BATCH_TIMEOUT)
+    pool.close()
+  except KeyboardInterrupt:
+    pool.terminate()
     return
-  
-  pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+  finally:
+    pool.join()
+
+  # Merge once and save, the fixes are measured apart from the pages
+  ocr = DiaryOCR(args)
+  start_page('review')
+  try:
+    ocr.merge_batch_results(results)
+    ocr.save_data()
+  except KeyboardInterrupt:
+    ocr.save_data()
+
+  end_page()
+
+def init_batch_worker(args):
+  global batch_args, batch_ocr
+
+  batch_args = args
+  batch_ocr = DiaryOCR(args, False)
+  batch_ocr.defer_fixes = True
+
+  # The registers replayed from the journal are not new
+  batch_ocr.annuary_data.pop_added_ids()
+  batch_ocr.diary_data.pop_added_modules()
+
+def process_batch_file(image_path):
+  annuary_data = batch_ocr.annuary_data
+  diary_data = batch_ocr.diary_data
+
+  batch_ocr.input_path = image_path
+  batch_ocr.pending_blocks = []
+
+  start_page(image_path)
+  batch_ocr.start()
+  end_page()
+
+  # The workers exit without printing the cache stats
+  flush_ocr_cache()
+
+  if batch_args.defer_errors:
+    batch_ocr.queue_pending_blocks(ReviewQueue(batch_args.review_dir))
+
+  # Return only the data added by this worker, a database already shares it
+  added_ids = annuary_data.pop_added_ids()
+  if is_sqlite_path(batch_args.annuary):
+    added_ids = []
+
+  modules = diary_data.pop_added_modules()
+  if is_sqlite_path(batch_args.output):
+    modules = []
+
+  registers = [annuary_data.data[num_id] for num_id in added_ids]
+
+  return {
+    'registers'      : registers,
+    'modules'        : modules,
+    'pending_blocks' : batch_ocr.pending_blocks
+  }
+
+# Main script
+def main():
 
   # Parse args
   parser = argparse.ArgumentParser(description='A digitalization of diary section from Francois-Xavier Guerra database.')
-  parser.add_argument('-i', '--input', help='Input image file')
-  parser.add_argument('-a', '--annuary', help='Annuary CSV file', default='csv/annuary.csv')
-  parser.add_argument('-o', '--output', help='Output CSV file', default='csv/diary.csv')
+  parser.add_argument('-i', '--input', help='Input image file, directory or glob pattern')
+  parser.add_argument('-a', '--annuary', help='Annuary CSV file, or SQLite database with .sqlite or .db extension', default='csv/annuary.csv')
+  parser.add_argument('-o', '--output', help='Output CSV file, or SQLite database with .sqlite or .db extension', default='csv/diary.csv')
   parser.add_argument('-d', '--debug', help='Enable debug option', action='store_true')
+  parser.add_argument('--import-csv', help='Add the modules of this CSV file to the output')
+  parser.add_argument('--export-csv', help='Write the modules of the output to this CSV file')
+  parser.add_argument('-r', '--review', help='Review the queued errors', action='store_true')
+  parser.add_argument('--build-catalogs', help='Compile the catalogs CSV into a single bundle', action='store_true')
+  parser.add_argument('--defer-errors', help='Queue the errors to review later instead of asking', action='store_true')
+  parser.add_argument('--review-dir', help='Directory of the errors review queue', default=DEFAULT_REVIEW_DIR)
+  parser.add_argument('--deskew-crops', help='Deskew only the crops readed by the OCR instead of the whole page', action='store_true')
+  parser.add_argument('-j', '--jobs', help='Number of worker processes on batch mode', type=int, default=multiprocessing.cpu_count())
+  parser.add_argument('--ocr-engine', help='OCR backend, tesserocr keeps one Tesseract loaded per worker', choices=OCR_BACKENDS, default='auto')
+  parser.add_argument('--stream', help='Deskew, binarize and find the columns strip by strip, uncompressed TIFF scans are decoded strip by strip too and the others whole, always whole with --deskew-crops', action='store_true')
+  parser.add_argument('--col-threads', help='Read the columns of a page on this number of threads', type=int, default=1)
+  parser.add_argument('--ocr-threads', help='Concurrent OCR calls inside a page, all the cores on a single page and one on batch mode by default', type=int)
+  parser.add_argument('--cache-dir', help='Directory of the OCR results cache', default=DEFAULT_CACHE_DIR)
+  parser.add_argument('--cache-size', help='Max size in MB of the OCR results cache', type=int, default=DEFAULT_CACHE_SIZE / (1024 * 1024))
+  parser.add_argument('--no-cache', help='Disable the OCR results cache', action='store_true')
+  parser.add_argument('--metrics', help='Append per page stage timings and counters to this file, JSON lines or CSV by extension')
+  parser.add_argument('--ocr-recording', help='Record the OCR results on this file, or read them from it with --ocr-engine replay')
 
   args = parser.parse_args()
+
+  # Move the modules between the CSV and the SQLite storages
+  if args.import_csv:
+    diary_data = open_diary_data(args.output)
+    diary_data.import_csv(args.import_csv)
+    diary_data.save()
+    return
+
+  if args.export_csv:
+    open_diary_data(args.output).export_csv(args.export_csv)
+    return
+
+  # Check tesseract installation, a replay runs without it
+  if args.ocr_engine != 'replay':
+    tesseract_cmd = get_tesseract_cmd()
+    if (not tesseract_cmd) or (tesseract_cmd == ''):
+      print('Tesseract not installed')
+      return
+
+    pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
   
+  if args.build_catalogs:
+    CatalogsData().build_bundle()
+    return
+
+  set_metrics_output(args.metrics)
+
+  if args.review:
+    ocr = DiaryOCR(args)
+    start_page('review')
+    try:
+      ocr.review_errors(ReviewQueue(args.review_dir))
+      ocr.save_data()
+    except KeyboardInterrupt:
+      ocr.save_data()
+
+    end_page()
+    return
+
   if not args.input:
     print('error: argument -i/--input is required')
     return
+
+  # The pool of workers already keeps all the cores busy on batch mode
+  if args.ocr_threads == None:
+    args.ocr_threads = 1 if (args.input and is_batch_input(args.input)) else multiprocessing.cpu_count()
+
+  # Every column thread and batch worker makes its own OCR calls
+  ocr_callers = args.col_threads
+  if args.input and is_batch_input(args.input):
+    ocr_callers *= args.jobs
+
+  try:
+    set_ocr_backend(args.ocr_engine)
+    set_ocr_recording(args.ocr_recording)
+    set_ocr_concurrency(args.ocr_threads, ocr_callers)
+  except ValueError as exception:
+    print('error: ' + str(exception))
+    return
+
+  if not args.no_cache:
+    set_ocr_cache(args.cache_dir, args.cache_size * 1024 * 1024)
   
   init_ts = time.time()
   
   #print_welcome_message()
 
+  if args.defer_errors:
+    args.debug = False
+
+  # The debug windows show whole pages
+  if args.stream:
+    args.debug = False
+
+  # Batch mode over a pool of workers
+  if is_batch_input(args.input):
+    args.debug = False
+    process_batch(args)
+
   # Create OCR and run
-  ocr = DiaryOCR(args)
-  try:
-    ocr.start()
-    ocr.save_data()
-  except KeyboardInterrupt:
+  else:
+    ocr = DiaryOCR(args)
+    ocr.defer_fixes = args.defer_errors
+    start_page(args.input)
+    try:
+      ocr.start()
+    except KeyboardInterrupt:
+      pass
+
+    end_page()
+
+    if args.defer_errors:
+      ocr.queue_pending_blocks(ReviewQueue(args.review_dir))
+
     ocr.save_data()
 
   duration = time.time() - init_ts
   print('\n  Finished at ' + str(duration) + ' seconds.')
 
+  ocr_cache = get_ocr_cache()
+  if ocr_cache:
+    ocr_cache.print_stats()
+
 if __name__ == '__main__':
   main()
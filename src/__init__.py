@@ -1,6 +1,14 @@
 # -*- coding: utf-8 -*-
 
+from .morphology import *
 from .utils import *
+from .instrumentation import *
+from .page_strips import *
+from .page_context import *
 from .catalogs_data import *
+from .ocr_cache import *
+from .ocr_recording import *
+from .ocr_engine import *
+from .review_queue import *
 from .annuary import *
 from .diary import *
\ No newline at end of file
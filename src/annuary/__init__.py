@@ -2,4 +2,5 @@
 
 from annuary_structure_detector import *
 from annuary_register_parser import *
-from annuary_data import *
\ No newline at end of file
+from annuary_data import *
+from annuary_sqlite_data import *
\ No newline at end of file
@@ -2,36 +2,112 @@
 
 import csv
 import os
+import numpy as np
+from ..utils import create_basedir, read_journal
+from annuary_register_parser import MAX_NUM_ID
 
 CSV_ANNUARY_FIELDNAMES = [ 'num_id', 'text_id', 'name', 'type', 'info' ]
+JOURNAL_ANNUARY_FIELDNAMES = [ 'op' ] + CSV_ANNUARY_FIELDNAMES
+JOURNAL_EXTENSION = '.journal'
 
 PERSON_START_ID = 0
 COMMUNITY_START_ID = 8999
 
 class AnnuaryData:
 
-  def __init__(self, csvpath=None):
+  def __init__(self, csvpath=None, journaled=True):
     self.data = {}
     self.csvpath = csvpath
+    self.journal = None
+
+    # IDs added since the last pop, the batch workers return them
+    self.added_ids = []
+
+    # Secondary indexes: counters and IDs bitmap by type
+    self.type_counts = {}
+    self.type_ids = {}
+    self.ids = np.zeros(MAX_NUM_ID + 1, np.bool_)
 
     should_read = (self.csvpath != None) and os.path.exists(self.csvpath)
     if should_read:
       self.load_from_file()
+
+    # Changes not saved yet are in the journal, batch workers only read it
+    if self.csvpath != None:
+      self.replay_journal()
+      if journaled:
+        self.open_journal()
   
   def load_from_file(self):
     print('\nANNUARY DATA\n')
     print('Loading data from file: ' + self.csvpath + '...')
-    
-    with open(self.csvpath, 'rb') as csvfile:
-      annuary_reader = csv.DictReader(csvfile, delimiter=',', quotechar="'", quoting=csv.QUOTE_NONNUMERIC)
 
-      for register in annuary_reader:
-        register['num_id'] = int(register['num_id'])
-        self.add_register(register)
-  
-      print('Loaded ' + str(len(self.data)) + ' registers!')
-    
+    for register in read_annuary_csv(self.csvpath):
+      self.add_register(register)
+
+    print('Loaded ' + str(len(self.data)) + ' registers!')
     print('--------------')
+
+  def import_csv(self, csvpath):
+    added = 0
+    for register in read_annuary_csv(csvpath):
+      if self.add_register(register):
+        added += 1
+
+    print('Imported ' + str(added) + ' annuary registers from ' + csvpath + '.')
+
+  def export_csv(self, csvpath):
+    write_annuary_csv(csvpath, self.sorted_registers())
+    print('Exported annuary registers to ' + csvpath + '.')
+
+  def get_journal_path(self):
+    return self.csvpath + JOURNAL_EXTENSION
+
+  def replay_journal(self):
+    journalpath = self.get_journal_path()
+    if not os.path.exists(journalpath):
+      return
+
+    replayed = 0
+    for entry in read_journal(journalpath, JOURNAL_ANNUARY_FIELDNAMES):
+      op = entry.pop('op')
+      entry['num_id'] = int(entry['num_id'])
+
+      if op == 'add':
+        self.add_register(entry)
+      elif op == 'update':
+        self.update_register(entry)
+
+      replayed += 1
+
+    if replayed > 0:
+      print('Replayed ' + str(replayed) + ' annuary changes from journal.')
+
+  def open_journal(self):
+    create_basedir(self.csvpath)
+
+    self.journalfile = open(self.get_journal_path(), 'ab')
+    self.journal = csv.DictWriter(self.journalfile, fieldnames=JOURNAL_ANNUARY_FIELDNAMES,
+                                                    delimiter=',',
+                                                    quotechar="'",
+                                                    quoting=csv.QUOTE_NONNUMERIC)
+
+  def write_journal(self, op, register):
+    if not self.journal:
+      return
+
+    entry = dict(register)
+    entry['op'] = op
+
+    self.journal.writerow(entry)
+    self.journalfile.flush()
+
+  def checkpoint(self):
+    if not self.journal:
+      return
+
+    self.journalfile.flush()
+    os.fsync(self.journalfile.fileno())
   
   def print_status(self):
     print('\nANNUARY DIGITALIZATION STATUS\n')
@@ -40,30 +116,25 @@ class AnnuaryData:
     print('Community: ' + str(self.count_by_type('community')) + ' registers.\n')
 
     print('ID Missings:')
-    self.print_missings(self.registers_by_type('person'), PERSON_START_ID)
-    self.print_missings(self.registers_by_type('community'), COMMUNITY_START_ID)
+    self.print_missings('person', PERSON_START_ID)
+    self.print_missings('community', COMMUNITY_START_ID)
   
   def count_by_type(self, register_type):
-    count = 0
+    return self.type_counts.get(register_type, 0)
 
-    for register_id in self.data:
-      register = self.data[register_id]
-      if register['type'] == register_type:
-        count += 1
-    
-    return count
+  def ids_by_type(self, register_type):
+    if not register_type in self.type_ids:
+      return np.zeros(0, np.int64)
+
+    return np.flatnonzero(self.type_ids[register_type])
   
   def registers_by_type(self, register_type):
-    registers = []
-
-    sorted_ids = sorted(self.data)
-    for register_id in sorted_ids:
-      register = self.data[register_id]
-      if register['type'] == register_type:
-        registers.append(register)
-    
-    return registers
+    return [self.data[num_id] for num_id in self.ids_by_type(register_type).tolist()]
   
+  def sorted_registers(self):
+    for num_id in sorted(self.data):
+      yield self.data[num_id]
+
   def search_by_num_id(self, num_id):
     if not (num_id in self.data):
       return None
@@ -78,30 +149,88 @@ class AnnuaryData:
     
     return register
   
-  def print_missings(self, registers, init_id):
-    last_id = init_id
+  def print_missings(self, register_type, init_id):
 
-    for register in registers:
-      range_diff = range(last_id, register['num_id'])
-      if len(range_diff) > 1:
-        print range_diff[1:]
+    # Consecutive missing IDs between the registers of the type
+    missing = self.missing_ids_by_type(register_type, init_id)
+    runs = np.split(missing, np.flatnonzero(np.diff(missing) != 1) + 1)
+
+    for run in runs:
+      if len(run) > 0:
+        print run.tolist()
+
+  def missing_ids_by_type(self, register_type, init_id):
+    sorted_ids = self.ids_by_type(register_type)
+    if len(sorted_ids) == 0:
+      return sorted_ids
 
-      last_id = register['num_id']
+    last_id = sorted_ids[-1]
+    if last_id <= init_id + 1:
+      return np.zeros(0, np.int64)
+
+    bitmap = self.type_ids[register_type][(init_id + 1):last_id]
+    return np.flatnonzero(~bitmap) + (init_id + 1)
+
+  def missing_ids(self, start_id, stop_id):
+    stop_id = min(stop_id, len(self.ids))
+    if start_id >= stop_id:
+      return np.zeros(0, np.int64)
+
+    return np.flatnonzero(~self.ids[start_id:stop_id]) + start_id
   
   def add_register(self, register):
     if register['num_id'] in self.data:
       return False
     
     self.data[register['num_id']] = register
+    self.index_register(register)
+    self.write_journal('add', register)
+    self.added_ids.append(register['num_id'])
     return True
+
+  def pop_added_ids(self):
+    added_ids = self.added_ids
+    self.added_ids = []
+
+    return added_ids
   
   def update_register(self, register):
     num_id = register['num_id']
     if not num_id in self.data:
       return False
     
+    self.unindex_register(self.data[num_id])
     self.data[num_id] = register
+    self.index_register(register)
+    self.write_journal('update', register)
     return True
+
+  def index_register(self, register):
+    num_id = register['num_id']
+    register_type = register['type']
+
+    # Grow bitmaps if the ID is out of them
+    if num_id >= len(self.ids):
+      size = num_id + 1
+      self.ids = np.concatenate((self.ids, np.zeros(size - len(self.ids), np.bool_)))
+      for indexed_type in self.type_ids:
+        bitmap = self.type_ids[indexed_type]
+        self.type_ids[indexed_type] = np.concatenate((bitmap, np.zeros(size - len(bitmap), np.bool_)))
+
+    if not register_type in self.type_ids:
+      self.type_ids[register_type] = np.zeros(len(self.ids), np.bool_)
+
+    self.ids[num_id] = True
+    self.type_ids[register_type][num_id] = True
+    self.type_counts[register_type] = self.type_counts.get(register_type, 0) + 1
+
+  def unindex_register(self, register):
+    num_id = register['num_id']
+    register_type = register['type']
+
+    self.ids[num_id] = False
+    self.type_ids[register_type][num_id] = False
+    self.type_counts[register_type] -= 1
   
   def save(self):
     if not self.csvpath:
@@ -109,22 +238,43 @@ class AnnuaryData:
     
     print('\nSaving annuary data to file ' + self.csvpath + '...')
 
-    # Create directories if dont exist
-    basedir = os.path.dirname(self.csvpath)
-    if not os.path.exists(basedir):
-      os.makedirs(basedir)
-    
-    with open(self.csvpath, 'wb') as csvfile:
-      annuary_writer = csv.DictWriter(csvfile, fieldnames=CSV_ANNUARY_FIELDNAMES,
-                                               delimiter=',',
-                                               quotechar="'",
-                                               quoting=csv.QUOTE_NONNUMERIC)
-
-      annuary_writer.writeheader()
-
-      sorted_ids = sorted(self.data)
-      for register_id in sorted_ids:
-        register = self.data[register_id]
-        annuary_writer.writerow(register)
+    write_annuary_csv(self.csvpath, self.sorted_registers())
+
+    # Saved data is compacted, so start an empty journal
+    if self.journal:
+      self.journalfile.close()
+      os.remove(self.get_journal_path())
+      self.open_journal()
     
-    print('File saved!')
\ No newline at end of file
+    print('File saved!')
+
+def read_annuary_csv(csvpath):
+  with open(csvpath, 'rb') as csvfile:
+    annuary_reader = csv.DictReader(csvfile, delimiter=',', quotechar="'", quoting=csv.QUOTE_NONNUMERIC)
+
+    for register in annuary_reader:
+      register['num_id'] = int(register['num_id'])
+      yield register
+
+def write_annuary_csv(csvpath, registers):
+
+  # Create directories if dont exist
+  create_basedir(csvpath)
+
+  # Write a new file and replace the old one at once
+  tmppath = csvpath + '.tmp'
+  with open(tmppath, 'wb') as csvfile:
+    annuary_writer = csv.DictWriter(csvfile, fieldnames=CSV_ANNUARY_FIELDNAMES,
+                                             delimiter=',',
+                                             quotechar="'",
+                                             quoting=csv.QUOTE_NONNUMERIC)
+
+    annuary_writer.writeheader()
+
+    for register in registers:
+      annuary_writer.writerow(register)
+
+    csvfile.flush()
+    os.fsync(csvfile.fileno())
+
+  os.rename(tmppath, csvpath)
\ No newline at end of file
@@ -25,6 +25,9 @@ class AnnuaryParsingException(Exception):
     Exception.__init__(self, message)
     self.error_code = code
 
+  def __reduce__(self):
+    return (self.__class__, (self.args[0], self.error_code))
+
 def parse_annuary_register_str(register_str):
 
   # Make a single line and tokenize
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import numpy as np
+from ..utils import is_sqlite_path, connect_sqlite
+from annuary_data import AnnuaryData, CSV_ANNUARY_FIELDNAMES, read_annuary_csv
+from annuary_register_parser import MAX_NUM_ID
+
+REGISTER_COLUMNS = ', '.join(CSV_ANNUARY_FIELDNAMES)
+INSERT_REGISTER = 'INSERT OR IGNORE INTO registers VALUES (:num_id, :text_id, :name, :type, :info)'
+UPDATE_REGISTER = 'UPDATE registers SET text_id = :text_id, name = :name, type = :type, info = :info WHERE num_id = :num_id'
+
+def open_annuary_data(path=None, journaled=True):
+
+  # The storage is choosen by the extension of the path
+  if is_sqlite_path(path):
+    return SQLiteAnnuaryData(path)
+
+  return AnnuaryData(path, journaled)
+
+class SQLiteRegisters:
+
+  # Read only dict view of the stored registers, by num_id
+  def __init__(self, annuary_data):
+    self.annuary_data = annuary_data
+
+  def __len__(self):
+    return self.annuary_data.query('SELECT COUNT(*) FROM registers')[0][0]
+
+  def __iter__(self):
+    return iter([row[0] for row in self.annuary_data.query('SELECT num_id FROM registers ORDER BY num_id')])
+
+  def __contains__(self, num_id):
+    return self.annuary_data.search_by_num_id(num_id) != None
+
+  def __getitem__(self, num_id):
+    register = self.annuary_data.search_by_num_id(num_id)
+    if register == None:
+      raise KeyError(num_id)
+
+    return register
+
+class SQLiteAnnuaryData(AnnuaryData):
+
+  def __init__(self, dbpath):
+    self.dbpath = dbpath
+    self.csvpath = None
+    self.journal = None
+    self.added_ids = []
+
+    # Every write is commited, so the workers see the others registers
+    self.connection = connect_sqlite(dbpath)
+    self.lock = threading.Lock()
+    self.connection.execute('CREATE TABLE IF NOT EXISTS registers (num_id INTEGER PRIMARY KEY, text_id TEXT, name TEXT, type TEXT, info TEXT)')
+    self.connection.execute('CREATE INDEX IF NOT EXISTS registers_text_id ON registers (text_id)')
+    self.connection.execute('CREATE INDEX IF NOT EXISTS registers_type ON registers (type)')
+    self.connection.commit()
+
+    self.data = SQLiteRegisters(self)
+
+    print('\nANNUARY DATA\n')
+    print('Opened database: ' + self.dbpath + ' with ' + str(len(self.data)) + ' registers.')
+    print('--------------')
+
+  def query(self, sql, params=()):
+    with self.lock:
+      return self.connection.execute(sql, params).fetchall()
+
+  def write(self, sql, params):
+    with self.lock:
+      changed = self.connection.execute(sql, params).rowcount
+      self.connection.commit()
+
+    return changed > 0
+
+  def import_csv(self, csvpath):
+
+    # A single transaction for the whole file
+    with self.lock:
+      changes = self.connection.total_changes
+      self.connection.executemany(INSERT_REGISTER, read_annuary_csv(csvpath))
+      self.connection.commit()
+      added = self.connection.total_changes - changes
+
+    print('Imported ' + str(added) + ' annuary registers from ' + csvpath + '.')
+
+  def checkpoint(self):
+    self.query('PRAGMA wal_checkpoint(PASSIVE)')
+
+  def count_by_type(self, register_type):
+    return self.query('SELECT COUNT(*) FROM registers WHERE type = ?', (register_type,))[0][0]
+
+  def ids_by_type(self, register_type):
+    rows = self.query('SELECT num_id FROM registers WHERE type = ? ORDER BY num_id', (register_type,))
+    return np.array([row[0] for row in rows], np.int64)
+
+  def registers_by_type(self, register_type):
+    rows = self.query('SELECT ' + REGISTER_COLUMNS + ' FROM registers WHERE type = ? ORDER BY num_id', (register_type,))
+    return [to_register(row) for row in rows]
+
+  def sorted_registers(self):
+    for row in self.query('SELECT ' + REGISTER_COLUMNS + ' FROM registers ORDER BY num_id'):
+      yield to_register(row)
+
+  def search_by_num_id(self, num_id):
+    rows = self.query('SELECT ' + REGISTER_COLUMNS + ' FROM registers WHERE num_id = ?', (num_id,))
+    if len(rows) == 0:
+      return None
+
+    return to_register(rows[0])
+
+  def missing_ids_by_type(self, register_type, init_id):
+    sorted_ids = self.ids_by_type(register_type)
+    if len(sorted_ids) == 0:
+      return sorted_ids
+
+    return np.setdiff1d(np.arange(init_id + 1, sorted_ids[-1], dtype=np.int64), sorted_ids, True)
+
+  def missing_ids(self, start_id, stop_id):
+
+    # Same range as the IDs bitmap of the CSV storage
+    last_id = self.query('SELECT MAX(num_id) FROM registers')[0][0] or 0
+    stop_id = min(stop_id, max(MAX_NUM_ID, last_id) + 1)
+    if start_id >= stop_id:
+      return np.zeros(0, np.int64)
+
+    rows = self.query('SELECT num_id FROM registers WHERE num_id >= ? AND num_id < ?', (start_id, stop_id))
+    stored_ids = np.array([row[0] for row in rows], np.int64)
+
+    return np.setdiff1d(np.arange(start_id, stop_id, dtype=np.int64), stored_ids, True)
+
+  def add_register(self, register):
+    added = self.write(INSERT_REGISTER, register)
+    if added:
+      self.added_ids.append(register['num_id'])
+
+    return added
+
+  def update_register(self, register):
+    return self.write(UPDATE_REGISTER, register)
+
+  def save(self):
+    print('\nSaving annuary data to database ' + self.dbpath + '...')
+
+    # Registers are already commited, move them from the WAL to the database
+    self.checkpoint()
+
+    print('Database saved!')
+
+def to_register(row):
+  return dict(zip(CSV_ANNUARY_FIELDNAMES, row))
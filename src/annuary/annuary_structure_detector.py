@@ -3,39 +3,32 @@
 import numpy as np
 import cv2
 from ..utils import *
+from ..morphology import *
+from ..page_strips import StripPage, find_boxes_on_strips, STRIP_HEIGHT
 
 COL_WIDTH = 1035
 MIN_COL_HEIGHT = 1000
+MAX_COL_HEIGHT = 2500
 MIN_COL_WIDTH = 40
 MIN_DISTANCE = 20
 MIN_ROW_AREA = 7700
 MAX_HEIGHT_ROW = 60
 MAX_X_ROW = 40
+MIN_ROW_CUT = 15
+COLS_DILATION = (60, 25)
 
-def find_columns_on_annuary(binary_image, args):
-
-  # Dilate image
-  kernel_dilation = np.ones((60, 25), np.uint8)
-  image_dilation = cv2.dilate(binary_image, kernel_dilation, iterations=1)
-
-  if args.debug:
-    show_scaled_image('cols dilation', image_dilation, 0.4)
-
-  # Find contours
-  im2, contours, hierarchy = cv2.findContours(image_dilation, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-  contours_img = draw_contours(binary_image, contours)
+ANNUARY_DETECTORS = [ 'contours', 'projection' ]
 
-  if args.debug:
-    show_scaled_image('contours cols', contours_img, 0.4)
+def find_columns_on_annuary(binary_image, args):
 
   # Get bounding boxes as detected columns
-  detected_cols = []
-  for contour in contours:
-    col = cv2.boundingRect(contour)
+  if args.detector == 'projection':
+    detected_cols = find_col_strips_by_projection(binary_image)
+  else:
+    detected_cols = find_col_strips_by_contours(binary_image, args)
+
+  detected_cols = [col for col in detected_cols if is_valid_annuary_col(col)]
 
-    if is_valid_annuary_col(col):
-      detected_cols.append(col)
-  
   # Sort by x
   detected_cols.sort(key=lambda col: col[0])
 
@@ -55,6 +48,56 @@ def find_columns_on_annuary(binary_image, args):
 
   return cols
 
+def find_col_strips_by_contours(binary_image, args):
+
+  # Strip pages join the components of each strip, dilated with margin
+  if isinstance(binary_image, StripPage):
+    dilation = lambda strip: dilate_rect(strip, COLS_DILATION)
+    return find_boxes_on_strips(binary_image, dilation, COLS_DILATION[0])
+
+  # Dilate image
+  image_dilation = dilate_rect(binary_image, COLS_DILATION)
+
+  if args.debug:
+    show_scaled_image('cols dilation', image_dilation, 0.4)
+
+  # Find contours
+  im2, contours, hierarchy = cv2.findContours(image_dilation, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+  contours_img = draw_contours(binary_image, contours)
+
+  if args.debug:
+    show_scaled_image('contours cols', contours_img, 0.4)
+
+  return [cv2.boundingRect(contour) for contour in contours]
+
+def find_col_strips_by_projection(binary_image):
+
+  # Same reach of the (60, 25) dilation on each axis
+  cut_profiles = (lambda profile: dilate_profile(profile, 25),
+                  lambda profile: dilate_profile(profile, 60))
+
+  # Smaller blocks never give a valid column
+  keep_region = lambda region: (region[3] > MIN_COL_HEIGHT) and (region[2] > MIN_COL_WIDTH)
+
+  blocks = cut_regions_by_profiles(binary_image, cut_profiles, keep_region, 0)
+
+  # Stacked blocks with ink over the gap give a single block, cut them on the row with less ink
+  cols = []
+  while len(blocks) > 0:
+    x, y, w, h = blocks.pop()
+    if h <= MAX_COL_HEIGHT:
+      cols.append((x, y, w, h))
+      continue
+
+    # Summed over the reach of the dilation, the gaps between text lines are not taken
+    ink_counts = get_region_ink_counts(binary_image, (x, y, w, h))
+    ink_counts = np.convolve(ink_counts, np.ones(COLS_DILATION[0], np.int32), 'same')
+    cut = MIN_COL_HEIGHT + int(np.argmin(ink_counts[MIN_COL_HEIGHT:h - MIN_COL_HEIGHT]))
+    for half in [(x, y, w, cut), (x, y + cut + 1, w, h - cut - 1)]:
+      blocks += cut_regions_by_profiles(binary_image, cut_profiles, keep_region, 0, half)
+
+  return cols
+
 def get_columns_from(left_col, width):
   left_x, left_y, left_w, left_h = left_col
 
@@ -75,16 +118,40 @@ def is_valid_annuary_col(col):
 
 def find_rows_on_annuary(binary_image, args):
 
+  # Create rows and sort them
+  if args.detector == 'projection':
+    detected_rows = find_row_bands_by_projection(binary_image)
+  else:
+    detected_rows = find_row_bands_by_contours(binary_image, args)
+
+  height, width = binary_image.shape[:2]
+
+  rows = []
+  for row in detected_rows:
+    if not is_valid_annuary_row(row):
+      continue
+    
+    x, y, w, h = row
+    rows.append((x, y, width, h))
+  
+  rows.sort(key=lambda row: row[1])
+
+  if args.debug:
+    boxes_img = draw_boxes(binary_image, rows, (0, 255, 0))
+    show_scaled_image('rows', boxes_img, 0.4)
+  
+  return rows
+
+def find_row_bands_by_contours(binary_image, args):
+
   # Dilate image
-  kernel_dilation = np.ones((1, 50), np.uint8)
-  image_dilation = cv2.dilate(binary_image, kernel_dilation, iterations=1)
+  image_dilation = dilate_rect(binary_image, (1, 50))
 
   if args.debug:
     show_scaled_image('rows dilation', image_dilation, 0.4)
   
   # Close image
-  kernel_closing = np.ones((1, 180), np.uint8)
-  image_closing = cv2.morphologyEx(image_dilation, cv2.MORPH_CLOSE, kernel_closing)
+  image_closing = close_rect(image_dilation, (1, 180))
 
   if args.debug:
     show_scaled_image('rows closing', image_closing, 0.4)
@@ -96,27 +163,127 @@ def find_rows_on_annuary(binary_image, args):
     contours_img = draw_contours(binary_image, contours)
     show_scaled_image('contours rows', contours_img, 0.4)
 
-  # Create rows and sort them
-  height, width = binary_image.shape[:2]
+  return [cv2.boundingRect(contour) for contour in contours]
 
-  rows = []
-  for contour in contours:
-    row = cv2.boundingRect(contour)
+def find_row_bands_by_projection(binary_image):
 
-    if not is_valid_annuary_row(row):
+  # Same dilation and closing on the columns, the rows are not dilated
+  cut_profiles = (lambda profile: close_profile(dilate_profile(profile, 50), 180),
+                  lambda profile: profile)
+
+  # Blocks starting far from the left never give a valid row
+  keep_region = lambda region: region[0] <= MAX_X_ROW
+
+  bands = cut_regions_by_profiles(binary_image, cut_profiles, keep_region, 1)
+
+  # Touching lines give a single band, cut them on the row with less ink
+  rows = []
+  while len(bands) > 0:
+    x, y, w, h = bands.pop()
+    if h <= MAX_HEIGHT_ROW:
+      rows.append((x, y, w, h))
       continue
-    
-    x, y, w, h = row
-    rows.append((x, y, width, h))
-  
-  rows.sort(key=lambda row: row[1])
 
-  if args.debug:
-    boxes_img = draw_boxes(binary_image, rows, (0, 255, 0))
-    show_scaled_image('rows', boxes_img, 0.4)
-  
+    band_img = binary_image[y+MIN_ROW_CUT:y+h-MIN_ROW_CUT, x:x+w]
+    cut = MIN_ROW_CUT + int(np.argmin(np.count_nonzero(band_img, axis=1)))
+    bands += [(x, y, w, cut), (x, y + cut + 1, w, h - cut - 1)]
+
   return rows
 
+def cut_regions_by_profiles(binary_image, cut_profiles, keep_region, axis, region=None):
+  height, width = binary_image.shape[:2]
+
+  # Recursive cuts on the gaps of the profiles until the blocks are stable
+  blocks = []
+  pending = [ (region or (0, 0, width, height), axis, False) ]
+  while len(pending) > 0:
+    region, axis, other_stable = pending.pop()
+    if not keep_region(region):
+      continue
+
+    regions = cut_region_by_profile(binary_image, region, axis, cut_profiles[axis])
+
+    # Stable when no axis cuts it
+    if regions == [ region ]:
+      if other_stable:
+        blocks.append(region)
+      else:
+        pending.append((region, 1 - axis, True))
+      continue
+
+    pending += [(cut, 1 - axis, False) for cut in regions]
+
+  return blocks
+
+def cut_region_by_profile(binary_image, region, axis, cut_profile):
+  x, y, w, h = region
+
+  # Axis 0 cuts on the gaps between columns, axis 1 between rows
+  profile = cut_profile(get_region_ink_profile(binary_image, region, axis))
+
+  regions = []
+  for start, length in get_profile_runs(profile):
+    if axis == 0:
+      regions.append((x + start, y, length, h))
+    else:
+      regions.append((x, y + start, w, length))
+
+  return regions
+
+def get_region_ink_profile(binary_image, region, axis):
+
+  # Strip pages are reduced strip by strip
+  if isinstance(binary_image, StripPage):
+    return binary_image.get_ink_profile(region, axis)
+
+  return get_ink_profile(crop_roi(binary_image, region), axis)
+
+def get_region_ink_counts(binary_image, region):
+  x, y, w, h = region
+
+  # Ink pixels by row, counted strip by strip to not unpack a whole strip page
+  counts = np.zeros(h, np.int32)
+  for strip_y in range(y, y + h, STRIP_HEIGHT):
+    strip_height = min(STRIP_HEIGHT, y + h - strip_y)
+    strip = crop_roi(binary_image, (x, strip_y, w, strip_height))
+    counts[strip_y - y:strip_y - y + strip_height] = np.count_nonzero(strip, axis=1)
+
+  return counts
+
+def get_ink_profile(binary_image, axis):
+
+  # Axis 0 gives one value by column, axis 1 one value by row
+  return binary_image.any(axis=axis)
+
+def dilate_profile(profile, size):
+
+  # Same window and anchor as cv2.dilate with a kernel of this size,
+  # the ink of each window is a difference of the cumulative sum
+  length = len(profile)
+  anchor = size // 2
+  cumsum = np.concatenate(([0], np.cumsum(profile, dtype=np.int32)))
+
+  starts = np.clip(np.arange(length) - anchor, 0, length)
+  stops = np.clip(np.arange(length) - anchor + size, 0, length)
+
+  return (cumsum[stops] - cumsum[starts]) > 0
+
+def close_profile(profile, size):
+
+  # Erosion as the dilation of the gaps, the border counts as ink
+  dilated = dilate_profile(profile, size)
+  return np.logical_not(dilate_profile(np.logical_not(dilated), size))
+
+def get_profile_runs(profile):
+
+  # Starts and stops of the runs of True values
+  padded = np.concatenate(([False], profile, [False])).astype(np.int8)
+  changes = np.flatnonzero(np.diff(padded))
+  starts = changes[0::2]
+  stops = changes[1::2]
+
+  return [(int(start), int(stop - start)) for start, stop in zip(starts, stops)]
+
 def is_valid_annuary_row(row):
   x = row[0]
   w = row[2]
@@ -1,6 +1,13 @@
 # -*- coding: utf-8 -*-
 
 import csv
+import marshal
+import os
+from .utils import create_basedir
+
+CATALOGS_DIR = 'csv'
+CATALOGS_BUNDLE_PATH = '.cache/catalogs.bundle'
+BUNDLE_VERSION = 1
 
 class CatalogsData:
 
@@ -42,34 +49,97 @@ class CatalogsData:
     41: { 'file': '41_military_divisons', 'header': [ 'military_division_id','military_division_id' ] }
   }
 
-  def __init__(self):
+  def __init__(self, bundlepath=CATALOGS_BUNDLE_PATH):
     self.catalogs = {}
+    self.bundlepath = bundlepath
+    self.bundle = None
+  
+  def get(self, catalog_id):
+    if not catalog_id in CatalogsData.CATALOGS_DESCRIPTION:
+      return None
+
+    # Catalogs are loaded on first use
+    if not catalog_id in self.catalogs:
+      self.catalogs[catalog_id] = self.load_catalog(catalog_id)
+
+    return self.catalogs[catalog_id]
 
-    print('\nCATALOGS DATA\n')
-    print('Loading catalogs...')
+  def load_catalog(self, catalog_id):
+    description = CatalogsData.CATALOGS_DESCRIPTION[catalog_id]
+    mtime = os.path.getmtime(get_catalog_path(description))
+
+    # Use the compiled catalog if the CSV has not changed
+    bundle = self.get_bundle()
+    if (catalog_id in bundle) and (bundle[catalog_id][0] == mtime):
+      return Catalog(description, marshal.loads(bundle[catalog_id][1]))
+
+    catalog = Catalog(description)
+    bundle[catalog_id] = (mtime, marshal.dumps(catalog.registers))
+    self.save_bundle()
+
+    return catalog
+
+  def build_bundle(self):
+    print('\nBuilding catalogs bundle ' + self.bundlepath + '...')
+
+    self.bundle = { 'version': BUNDLE_VERSION }
+    self.catalogs = {}
 
     for catalog_id in CatalogsData.CATALOGS_DESCRIPTION:
       description = CatalogsData.CATALOGS_DESCRIPTION[catalog_id]
-      self.catalogs[catalog_id] = Catalog(description)
+      catalog = Catalog(description)
+      mtime = os.path.getmtime(get_catalog_path(description))
 
-    print('Catalogs loaded!')
-    print('--------------')
-  
-  def get(self, catalog_id):
-    if not catalog_id in self.catalogs:
-      return None
+      self.catalogs[catalog_id] = catalog
+      self.bundle[catalog_id] = (mtime, marshal.dumps(catalog.registers))
 
-    return self.catalogs[catalog_id]
+    self.save_bundle()
+    print('Built ' + str(len(self.catalogs)) + ' catalogs!')
+
+  def get_bundle(self):
+    if self.bundle != None:
+      return self.bundle
+
+    self.bundle = { 'version': BUNDLE_VERSION }
+
+    if os.path.exists(self.bundlepath):
+      try:
+        with open(self.bundlepath, 'rb') as bundlefile:
+          bundle = marshal.load(bundlefile)
+
+        if bundle.get('version') == BUNDLE_VERSION:
+          self.bundle = bundle
+      except (EOFError, ValueError, TypeError):
+        pass
+
+    return self.bundle
+
+  def save_bundle(self):
+    create_basedir(self.bundlepath)
+
+    # Other workers may be reading it, so replace it at once
+    tmppath = self.bundlepath + '.' + str(os.getpid()) + '.tmp'
+    with open(tmppath, 'wb') as bundlefile:
+      marshal.dump(self.bundle, bundlefile)
+
+    os.rename(tmppath, self.bundlepath)
+
+def get_catalog_path(catalog_description):
+  return os.path.join(CATALOGS_DIR, catalog_description['file'] + '.csv')
 
 class Catalog:
 
-  def __init__(self, catalog_description):
+  def __init__(self, catalog_description, registers=None):
 
     self.header = catalog_description['header']
     self.field_key = self.header[0]
-    self.registers = {}
+    self.registers = registers
+
+    if self.registers == None:
+      self.load_from_file(get_catalog_path(catalog_description))
 
-    csvpath = 'csv/' + catalog_description['file'] + '.csv'
+  def load_from_file(self, csvpath):
+    self.registers = {}
 
     with open(csvpath, 'rb') as csvfile:
       csvreader = csv.DictReader(csvfile, delimiter=',', quotechar="'", quoting=csv.QUOTE_NONNUMERIC)
@@ -2,4 +2,6 @@
 
 from diary_structure_detector import *
 from diary_data import *
+from diary_sqlite_data import *
+from catalog_corrector import *
 from diary_module_parser import *
\ No newline at end of file
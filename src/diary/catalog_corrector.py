@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+# Chars that the OCR confuses between them on the diary typewriter font
+CONFUSION_GROUPS = [ 'O0DQ', 'I1L', 'S5', 'Z2', 'G6', 'T7', 'B8', 'MN', 'VY' ]
+
+# Any other substitution costs more than the radius, only confusions are corrected
+MAX_CORRECTION_DISTANCE = 2
+CONFUSION_COST = 1
+SUBSTITUTION_COST = MAX_CORRECTION_DISTANCE + 1
+
+CONFUSED_CHARS = set((a, b) for group in CONFUSION_GROUPS for a in group for b in group if a != b)
+
+def confusion_distance(str_a, str_b):
+
+  # Zones have fixed size, only substitutions are possible
+  if len(str_a) != len(str_b):
+    return None
+
+  distance = 0
+  for char_a, char_b in zip(str_a, str_b):
+    if char_a == char_b:
+      continue
+
+    if (char_a, char_b) in CONFUSED_CHARS:
+      distance += CONFUSION_COST
+    else:
+      distance += SUBSTITUTION_COST
+
+  return distance
+
+class BKTree:
+
+  def __init__(self, keys):
+    self.root = None
+
+    for key in keys:
+      self.add(key)
+
+  def add(self, key):
+    if self.root == None:
+      self.root = (key, {})
+      return
+
+    node = self.root
+    while True:
+      node_key, children = node
+      distance = confusion_distance(key, node_key)
+
+      if distance == 0:
+        return
+
+      if not distance in children:
+        children[distance] = (key, {})
+        return
+
+      node = children[distance]
+
+  def search(self, key, radius):
+    found = []
+    if self.root == None:
+      return found
+
+    pending = [ self.root ]
+    while len(pending) > 0:
+      node_key, children = pending.pop()
+      distance = confusion_distance(key, node_key)
+
+      if distance <= radius:
+        found.append((distance, node_key))
+
+      # Triangle inequality prunes the children out of range
+      for child_distance in children:
+        if (distance - radius) <= child_distance <= (distance + radius):
+          pending.append(children[child_distance])
+
+    return found
+
+class CatalogCorrector:
+
+  def __init__(self, catalogs_data):
+    self.catalogs_data = catalogs_data
+    self.trees = {}
+
+  def get_tree(self, catalog_id, length):
+    tree_key = (catalog_id, length)
+
+    # One tree for each catalog and key length, built on first use
+    if not tree_key in self.trees:
+      catalog = self.catalogs_data.get(catalog_id)
+      keys = [key for key in catalog.registers if len(key) == length]
+      self.trees[tree_key] = BKTree(keys)
+
+    return self.trees[tree_key]
+
+  def correct(self, catalog_id, zone_str):
+    if self.catalogs_data.get(catalog_id) == None:
+      return None
+
+    tree = self.get_tree(catalog_id, len(zone_str))
+    candidates = tree.search(zone_str, MAX_CORRECTION_DISTANCE)
+    if len(candidates) == 0:
+      return None
+
+    # Only a unique closest candidate is accepted
+    best_distance = min(distance for distance, key in candidates)
+    best = [key for distance, key in candidates if distance == best_distance]
+
+    if len(best) != 1:
+      return None
+
+    return best[0]
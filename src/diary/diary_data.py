@@ -2,34 +2,97 @@
 
 import csv
 import os
+from ..utils import create_basedir, read_journal
 
 CSV_DIARY_FIELDNAMES = [ 'annuary_id', 'module' ]
+JOURNAL_DIARY_FIELDNAMES = [ 'op' ] + CSV_DIARY_FIELDNAMES
+JOURNAL_EXTENSION = '.journal'
 
 class DiaryData:
 
-  def __init__(self, csvpath=None):
+  def __init__(self, csvpath=None, journaled=True):
     self.data = {}
+    self.index = set()
+
+    # Modules added since the last pop, the batch workers return them
+    self.added_modules = []
 
     self.csvpath = csvpath
+    self.journal = None
 
     should_read = (self.csvpath != None) and os.path.exists(self.csvpath)
     if should_read:
       self.load_from_file()
 
+    # Changes not saved yet are in the journal, batch workers only read it
+    if self.csvpath != None:
+      self.replay_journal()
+      if journaled:
+        self.open_journal()
+
   def load_from_file(self):
     print('\nDIARY DATA\n')
     print('Loading data from file: ' + self.csvpath + '...')
-    
-    with open(self.csvpath, 'rb') as csvfile:
-      diary_reader = csv.DictReader(csvfile, delimiter=',', quotechar="'", quoting=csv.QUOTE_NONNUMERIC)
 
-      for register in diary_reader:
-        self.add_module(register['annuary_id'], register['module'])
-  
-      print('Loaded ' + str(len(self.data)) + ' registers!')
-    
+    for annuary_id, module_str in read_diary_csv(self.csvpath):
+      self.add_module(annuary_id, module_str)
+
+    print('Loaded ' + str(len(self.data)) + ' registers!')
     print('--------------')
 
+  def import_csv(self, csvpath):
+    added = 0
+    for annuary_id, module_str in read_diary_csv(csvpath):
+      if self.add_module(annuary_id, module_str):
+        added += 1
+
+    print('Imported ' + str(added) + ' diary modules from ' + csvpath + '.')
+
+  def export_csv(self, csvpath):
+    write_diary_csv(csvpath, self.sorted_modules())
+    print('Exported diary modules to ' + csvpath + '.')
+
+  def get_journal_path(self):
+    return self.csvpath + JOURNAL_EXTENSION
+
+  def replay_journal(self):
+    journalpath = self.get_journal_path()
+    if not os.path.exists(journalpath):
+      return
+
+    replayed = 0
+    for entry in read_journal(journalpath, JOURNAL_DIARY_FIELDNAMES):
+      if entry['op'] == 'add':
+        self.add_module(entry['annuary_id'], entry['module'])
+
+      replayed += 1
+
+    if replayed > 0:
+      print('Replayed ' + str(replayed) + ' diary changes from journal.')
+
+  def open_journal(self):
+    create_basedir(self.csvpath)
+
+    self.journalfile = open(self.get_journal_path(), 'ab')
+    self.journal = csv.DictWriter(self.journalfile, fieldnames=JOURNAL_DIARY_FIELDNAMES,
+                                                    delimiter=',',
+                                                    quotechar="'",
+                                                    quoting=csv.QUOTE_NONNUMERIC)
+
+  def write_journal(self, op, annuary_id, module_str):
+    if not self.journal:
+      return
+
+    self.journal.writerow({ 'op': op, 'annuary_id': int(annuary_id), 'module': module_str })
+    self.journalfile.flush()
+
+  def checkpoint(self):
+    if not self.journal:
+      return
+
+    self.journalfile.flush()
+    os.fsync(self.journalfile.fileno())
+
   def add_module(self, annuary_id, module):
 
     module_str = module
@@ -38,7 +101,8 @@ class DiaryData:
       module_str = '|'.join(module)
 
     # Check if the module has been added
-    if (annuary_id in self.data) and (module_str in self.data[annuary_id]):
+    index_key = (annuary_id, module_str)
+    if index_key in self.index:
       return False
     
     # If is the first module its create the register
@@ -46,8 +110,25 @@ class DiaryData:
       self.data[annuary_id] = []
     
     self.data[annuary_id].append(module_str)
+    self.index.add(index_key)
+    self.write_journal('add', annuary_id, module_str)
+    self.added_modules.append(index_key)
     return True
+
+  def pop_added_modules(self):
+    added_modules = self.added_modules
+    self.added_modules = []
+
+    return added_modules
   
+  def sorted_modules(self):
+    for annuary_id in sorted(self.data):
+      for module_str in self.data[annuary_id]:
+        yield (annuary_id, module_str)
+
+  def stored_annuary_ids(self):
+    return set(annuary_id for annuary_id in self.data if len(self.data[annuary_id]) > 0)
+
   def search_by_annuary_id(self, annuary_id):
     if not (annuary_id in self.data):
       return None
@@ -60,25 +141,43 @@ class DiaryData:
     
     print('\nSaving diary data to file ' + self.csvpath + '...')
 
-    # Create directories if dont exist
-    basedir = os.path.dirname(self.csvpath)
-    if not os.path.exists(basedir):
-      os.makedirs(basedir)
-    
-    with open(self.csvpath, 'wb') as csvfile:
-      diary_writer = csv.DictWriter(csvfile, fieldnames=CSV_DIARY_FIELDNAMES,
-                                             delimiter=',',
-                                             quotechar="'",
-                                             quoting=csv.QUOTE_NONNUMERIC)
-
-      diary_writer.writeheader()
-
-      sorted_ids = sorted(self.data)
-      for annuary_id in sorted_ids:
-        modules = self.data[annuary_id]
-        
-        for module_str in modules:
-          csvrow = { 'annuary_id': int(annuary_id), 'module': module_str }
-          diary_writer.writerow(csvrow)
+    write_diary_csv(self.csvpath, self.sorted_modules())
+
+    # Saved data is compacted, so start an empty journal
+    if self.journal:
+      self.journalfile.close()
+      os.remove(self.get_journal_path())
+      self.open_journal()
     
-    print('File saved!')
\ No newline at end of file
+    print('File saved!')
+
+def read_diary_csv(csvpath):
+  with open(csvpath, 'rb') as csvfile:
+    diary_reader = csv.DictReader(csvfile, delimiter=',', quotechar="'", quoting=csv.QUOTE_NONNUMERIC)
+
+    for register in diary_reader:
+      yield (register['annuary_id'], register['module'])
+
+def write_diary_csv(csvpath, modules):
+
+  # Create directories if dont exist
+  create_basedir(csvpath)
+
+  # Write a new file and replace the old one at once
+  tmppath = csvpath + '.tmp'
+  with open(tmppath, 'wb') as csvfile:
+    diary_writer = csv.DictWriter(csvfile, fieldnames=CSV_DIARY_FIELDNAMES,
+                                           delimiter=',',
+                                           quotechar="'",
+                                           quoting=csv.QUOTE_NONNUMERIC)
+
+    diary_writer.writeheader()
+
+    for annuary_id, module_str in modules:
+      csvrow = { 'annuary_id': int(annuary_id), 'module': module_str }
+      diary_writer.writerow(csvrow)
+
+    csvfile.flush()
+    os.fsync(csvfile.fileno())
+
+  os.rename(tmppath, csvpath)
\ No newline at end of file
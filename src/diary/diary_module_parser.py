@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 
+import copy
 import re
 from ..utils import matches
 from ..catalogs_data import CatalogsData
+from catalog_corrector import CatalogCorrector
 
 class DiaryParsingException(Exception):
 
@@ -21,6 +23,10 @@ class DiaryParsingException(Exception):
     self.zone = zone
     self.zone_str = zone_str
 
+  def __reduce__(self):
+    args = (self.args[0], self.error_code, self.num_module, self.zone, self.zone_str)
+    return (self.__class__, args)
+
 class DiaryModuleParser:
 
   # module_type: [ (catalog, spaces), (catalog, spaces), ... ]
@@ -74,6 +80,10 @@ class DiaryModuleParser:
     '=':  [ (39, 1), (1, 2), (2, 1), (3, 2), (0,2), (0,1) ]
   }
 
+  # OCR confusions at the start of the module: (readed, module type prefix)
+  # 'B1' goes before '8' so '81' is also read as 'BI'
+  MODULE_TYPE_CONFUSIONS = [ ('B1', 'BI'), ('8', 'B'), ('O', 'D'), ('0', 'D'), ('55', 'S') ]
+
   SPACE_CHAR = '_'
   YEAR_PATTERN = re.compile(u'^[0-9]*$')
   NUM_ID_PATTERN = re.compile(u'^[0-9]*$')
@@ -115,8 +125,12 @@ class DiaryModuleParser:
 
   def __init__(self, annuary_data):
     self.catalogs_data = CatalogsData()
+    self.catalog_corrector = CatalogCorrector(self.catalogs_data)
     self.annuary_data = annuary_data
 
+    self.module_types_trie = compile_module_types_trie(DiaryModuleParser.MODULE_ZONES,
+                                                       DiaryModuleParser.MODULE_TYPE_CONFUSIONS)
+
   def parse_modules(self, modules, skipping):
 
     if len(modules) > 3:
@@ -182,29 +196,19 @@ class DiaryModuleParser:
   
   def get_module_type(self, module_str):
 
-    if module_str.startswith('8'):
-      module_str = 'B' + module_str[1:]
-    
-    if module_str.startswith('O') or module_str.startswith('0'):
-      module_str = 'D' + module_str[1:]
+    # Longest module type prefix on the trie
+    module_type = None
 
-    if module_str.startswith('B1'):
-      module_str = 'BI' + module_str[2:]
-    
-    if module_str.startswith('88'):
-      module_str = 'BB' + module_str[2:]
-    
-    if module_str.startswith('55'):
-      module_str = 'SS' + module_str[2:]
-    
-    if module_str.startswith('05') or module_str.startswith('O5'):
-      module_str = 'DS' + module_str[2:]
-    
-    for module_type in DiaryModuleParser.MODULE_ZONES:
-      if module_str.startswith(module_type):
-        return module_type
+    node = self.module_types_trie
+    for char in module_str:
+      if not char in node:
+        break
+
+      node = node[char]
+      if MODULE_TYPE_KEY in node:
+        module_type = node[MODULE_TYPE_KEY]
     
-    return None
+    return module_type
 
   def parse_zone(self, zone, zone_str, module_str):
 
@@ -242,6 +246,13 @@ class DiaryModuleParser:
     catalog_register = catalog.get(zone_str)
 
     if not catalog_register:
+
+      # Try the closest value of the catalog before giving up
+      corrected_str = self.catalog_corrector.correct(catalog_id, zone_str)
+      if corrected_str != None:
+        print('  Corrected value: ' + zone_str + ' to ' + corrected_str + ' on catalog: ' + str(zone[0]))
+        return corrected_str
+
       msg = 'Not found value: ' + zone_str + ' on catalog: ' + str(zone[0]) + ' in: ' + module_str
       code = DiaryParsingException.INVALID_VALUE_ON_ZONE
       raise DiaryParsingException(msg, code, zone=zone, zone_str=zone_str)
@@ -295,4 +306,30 @@ class DiaryModuleParser:
     for bad_str in changes:
       tmp = tmp.replace(bad_str, changes[bad_str])
     
-    return tmp
\ No newline at end of file
+    return tmp
+
+MODULE_TYPE_KEY = None
+
+def compile_module_types_trie(module_types, confusions):
+  trie = {}
+
+  for module_type in module_types:
+    node = get_trie_node(trie, module_type)
+    node[MODULE_TYPE_KEY] = module_type
+
+  # A confusion is a copy of the path it should be readed as
+  for readed, meant in confusions:
+    parent = get_trie_node(trie, readed[:-1])
+    parent[readed[-1]] = copy.deepcopy(get_trie_node(trie, meant))
+
+  return trie
+
+def get_trie_node(trie, prefix):
+  node = trie
+  for char in prefix:
+    if not char in node:
+      node[char] = {}
+
+    node = node[char]
+
+  return node
\ No newline at end of file
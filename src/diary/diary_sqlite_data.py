@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from ..utils import is_sqlite_path, connect_sqlite
+from diary_data import DiaryData, read_diary_csv
+
+INSERT_MODULE = 'INSERT OR IGNORE INTO modules (annuary_id, module) VALUES (?, ?)'
+
+def open_diary_data(path=None, journaled=True):
+
+  # The storage is choosen by the extension of the path
+  if is_sqlite_path(path):
+    return SQLiteDiaryData(path)
+
+  return DiaryData(path, journaled)
+
+class SQLiteModules:
+
+  # Read only dict view of the stored modules, by annuary_id
+  def __init__(self, diary_data):
+    self.diary_data = diary_data
+
+  def __len__(self):
+    return self.diary_data.query('SELECT COUNT(DISTINCT annuary_id) FROM modules')[0][0]
+
+  def __iter__(self):
+    return iter([row[0] for row in self.diary_data.query('SELECT DISTINCT annuary_id FROM modules ORDER BY annuary_id')])
+
+  def __contains__(self, annuary_id):
+    return self.diary_data.search_by_annuary_id(annuary_id) != None
+
+  def __getitem__(self, annuary_id):
+    modules = self.diary_data.search_by_annuary_id(annuary_id)
+    if modules == None:
+      raise KeyError(annuary_id)
+
+    return modules
+
+class SQLiteDiaryData(DiaryData):
+
+  def __init__(self, dbpath):
+    self.dbpath = dbpath
+    self.csvpath = None
+    self.journal = None
+    self.added_modules = []
+
+    # The rowid keeps the modules of a register in the adding order
+    self.connection = connect_sqlite(dbpath)
+    self.lock = threading.Lock()
+    self.connection.execute('CREATE TABLE IF NOT EXISTS modules (id INTEGER PRIMARY KEY, annuary_id INTEGER, module TEXT)')
+    self.connection.execute('CREATE UNIQUE INDEX IF NOT EXISTS modules_annuary_id_module ON modules (annuary_id, module)')
+    self.connection.commit()
+
+    self.data = SQLiteModules(self)
+
+    print('\nDIARY DATA\n')
+    print('Opened database: ' + self.dbpath + ' with ' + str(len(self.data)) + ' registers.')
+    print('--------------')
+
+  def query(self, sql, params=()):
+    with self.lock:
+      return self.connection.execute(sql, params).fetchall()
+
+  def import_csv(self, csvpath):
+    modules = ((int(annuary_id), module_str) for annuary_id, module_str in read_diary_csv(csvpath))
+
+    # A single transaction for the whole file
+    with self.lock:
+      changes = self.connection.total_changes
+      self.connection.executemany(INSERT_MODULE, modules)
+      self.connection.commit()
+      added = self.connection.total_changes - changes
+
+    print('Imported ' + str(added) + ' diary modules from ' + csvpath + '.')
+
+  def checkpoint(self):
+    self.query('PRAGMA wal_checkpoint(PASSIVE)')
+
+  def add_module(self, annuary_id, module):
+
+    module_str = module
+
+    if not isinstance(module, str):
+      module_str = '|'.join(module)
+
+    # The unique index discards the modules already added
+    with self.lock:
+      changed = self.connection.execute(INSERT_MODULE, (int(annuary_id), module_str)).rowcount
+      self.connection.commit()
+
+    if changed > 0:
+      self.added_modules.append((annuary_id, module_str))
+
+    return changed > 0
+
+  def sorted_modules(self):
+    return self.query('SELECT annuary_id, module FROM modules ORDER BY annuary_id, id')
+
+  def stored_annuary_ids(self):
+    return set(row[0] for row in self.query('SELECT DISTINCT annuary_id FROM modules'))
+
+  def search_by_annuary_id(self, annuary_id):
+    rows = self.query('SELECT module FROM modules WHERE annuary_id = ? ORDER BY id', (int(annuary_id),))
+    if len(rows) == 0:
+      return None
+
+    return [row[0] for row in rows]
+
+  def save(self):
+    print('\nSaving diary data to database ' + self.dbpath + '...')
+
+    # Modules are already commited, move them from the WAL to the database
+    self.checkpoint()
+
+    print('Database saved!')
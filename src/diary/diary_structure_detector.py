@@ -3,6 +3,8 @@
 import numpy as np
 import cv2
 from ..utils import *
+from ..morphology import *
+from ..page_strips import StripPage, find_boxes_on_strips
 
 COL_WIDTH = 1040
 MIN_COL_HEIGHT = 1000
@@ -16,34 +18,17 @@ MIN_CHAR_HEIGHT = 6
 MAX_CHAR_WIDTH = 29
 AVG_CHAR_WIDTH = 20
 AVG_SPACE_WIDTH = 23
+COLS_CLOSING = (40, 85)
 
 def find_columns_on_diary(binary_image, debug):
 
-  # Remove noise
-  kernel_open = np.ones((3, 3),np.uint8)
-  image_open = cv2.morphologyEx(binary_image, cv2.MORPH_OPEN, kernel_open)
-
-  # Close image
-  kernel_close = np.ones((40, 85), np.uint8)
-  image_close = cv2.morphologyEx(image_open, cv2.MORPH_CLOSE, kernel_close)
-
-  if debug:
-    show_scaled_image('cols dilation', image_close, 0.4)
-
-  # Find contours
-  contours = cv2.findContours(image_close, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)[1]
-
-  if debug:
-    contours_img = draw_contours(binary_image, contours)
-    show_scaled_image('contours cols', contours_img, 0.4)
-  
   # Get bounding boxes as detected columns
-  detected_cols = []
-  for contour in contours:
-    col = cv2.boundingRect(contour)
+  if isinstance(binary_image, StripPage):
+    boxes = find_col_boxes_on_strips(binary_image)
+  else:
+    boxes = find_col_boxes(binary_image, debug)
 
-    if is_valid_diary_col(col):
-      detected_cols.append(col)
+  detected_cols = [col for col in boxes if is_valid_diary_col(col)]
   
   # Sort by x and y
   detected_cols.sort(key=lambda col: col[0])
@@ -64,6 +49,37 @@ def find_columns_on_diary(binary_image, debug):
 
   return cols
 
+def close_diary_cols(binary_image):
+
+  # Remove noise
+  kernel_open = np.ones((3, 3),np.uint8)
+  image_open = cv2.morphologyEx(binary_image, cv2.MORPH_OPEN, kernel_open)
+
+  # Close image with cv2, the log-window helper does not win with this kernel
+  kernel_close = np.ones(COLS_CLOSING, np.uint8)
+  return cv2.morphologyEx(image_open, cv2.MORPH_CLOSE, kernel_close)
+
+def find_col_boxes(binary_image, debug):
+  image_close = close_diary_cols(binary_image)
+
+  if debug:
+    show_scaled_image('cols dilation', image_close, 0.4)
+
+  # Find contours
+  contours = cv2.findContours(image_close, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)[1]
+
+  if debug:
+    contours_img = draw_contours(binary_image, contours)
+    show_scaled_image('contours cols', contours_img, 0.4)
+
+  return [cv2.boundingRect(contour) for contour in contours]
+
+def find_col_boxes_on_strips(strip_page):
+
+  # Margin for the opening and the closing, each strip is exact on its rows
+  margin = 3 + (2 * COLS_CLOSING[0])
+  return find_boxes_on_strips(strip_page, close_diary_cols, margin)
+
 def is_valid_diary_col(col):
   w = col[2]
   h = col[3]
@@ -88,8 +104,7 @@ def find_blocks_on_diary_col(img_col, debug):
   image_open = cv2.morphologyEx(img_col, cv2.MORPH_OPEN, kernel_open)
 
   # Close image
-  kernel_close = np.ones((2, 200), np.uint8)
-  image_dilation = cv2.morphologyEx(image_open, cv2.MORPH_CLOSE, kernel_close)
+  image_dilation = close_rect(image_open, (2, 200))
 
   if debug:
     show_scaled_image('blocks dilation', image_dilation, 0.4)
@@ -173,8 +188,7 @@ def find_diary_content_rows(content_img, debug):
 
   # Close image
   width = content_img.shape[1]
-  kernel_close = np.ones((5, width), np.uint8)
-  image_close = cv2.morphologyEx(image_open, cv2.MORPH_CLOSE, kernel_close)
+  image_close = close_rect(image_open, (5, width))
 
   # Find contours and filter
   contours = cv2.findContours(image_close, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)[1]
@@ -199,17 +213,9 @@ def is_valid_content_row(cnt):
 
 def get_modules_on_content_row(content_row_img, debug):
 
-  # Find chars contours
-  kernel_close = np.ones((5, 4), np.uint8)
-  image_close = cv2.morphologyEx(content_row_img, cv2.MORPH_CLOSE, kernel_close)
-
-  contours = cv2.findContours(image_close, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)[1]
-  contours = [cnt for cnt in contours if cv2.contourArea(cnt) > MIN_CHAR_AREA]
-  contours = [cnt for cnt in contours if cv2.boundingRect(cnt)[3] > MIN_CHAR_HEIGHT]
-
   # Get bounding boxes, filter and sort
-  rects = map(get_bounding_rect_char(content_row_img.shape[0]), contours)
-  rects = [rect for rect in rects if not is_rect_inside_another(rect, rects)]
+  rects = find_char_rects(content_row_img)
+  rects = remove_inner_rects(rects)
   rects.sort(key=lambda rect:rect[0])
   rects = merge_overlays_and_brokens(rects)
 
@@ -219,6 +225,18 @@ def get_modules_on_content_row(content_row_img, debug):
   
   return get_modules_from_rects(rects)
 
+def find_char_rects(content_row_img):
+
+  # Find chars contours
+  kernel_close = np.ones((5, 4), np.uint8)
+  image_close = cv2.morphologyEx(content_row_img, cv2.MORPH_CLOSE, kernel_close)
+
+  contours = cv2.findContours(image_close, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)[1]
+  contours = [cnt for cnt in contours if cv2.contourArea(cnt) > MIN_CHAR_AREA]
+  contours = [cnt for cnt in contours if cv2.boundingRect(cnt)[3] > MIN_CHAR_HEIGHT]
+
+  return map(get_bounding_rect_char(content_row_img.shape[0]), contours)
+
 def get_bounding_rect_char(height):
   def bounding_rect_char(cnt):
     x, y, w, h = cv2.boundingRect(cnt)
@@ -226,17 +244,22 @@ def get_bounding_rect_char(height):
 
   return bounding_rect_char
 
-def is_rect_inside_another(rect, rects):
-  x_a, y_a, w_a, h_a = rect
+def remove_inner_rects(rects):
+  if len(rects) == 0:
+    return []
 
-  for another_rect in rects:
-    x_b, y_b, w_b, h_b = another_rect
-    range_x = range(x_b, x_b + w_b)
+  # A rect is inner if another starts before or at it and ends after it
+  rects_arr = np.array(rects)
+  starts = rects_arr[:, 0]
+  stops = starts + rects_arr[:, 2]
 
-    if (x_a in range_x) and ((x_a + w_a) in range_x):
-      return True
+  # Sweep sorted by start keeping the farthest stop seen so far
+  order = np.argsort(starts, kind='mergesort')
+  max_stops = np.maximum.accumulate(stops[order])
+  last_started = np.searchsorted(starts[order], starts, side='right') - 1
 
-  return False
+  inner = max_stops[last_started] > stops
+  return [rect for rect, is_inner in zip(rects, inner) if not is_inner]
 
 def merge_overlays_and_brokens(rects):
 
@@ -267,9 +290,11 @@ def merge_overlays_and_brokens(rects):
   return merged_rects
 
 def are_rects_overlaped(rect_a, rect_b):
-  range_x = range(rect_a[0], rect_a[0] + rect_a[2])
+  start_a = rect_a[0]
+  stop_a = rect_a[0] + rect_a[2]
+  stop_b = rect_b[0] + rect_b[2]
 
-  return (rect_b[0] in range_x) or ((rect_b[0] + rect_b[2]) in range_x)
+  return (start_a <= rect_b[0] < stop_a) or (start_a <= stop_b < stop_a)
 
 def merge_rects(rect_a, rect_b):
   x_a, y_a, w_a, h_a = rect_a
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import threading
+import time
+from .utils import create_basedir
+
+STAGES = [ 'decode', 'deskew', 'binarize', 'columns', 'blocks', 'rows', 'ocr', 'parse' ]
+COUNTERS = [ 'ocr_calls', 'cache_hits', 'cache_misses', 'parse_failures', 'interventions', 'replay_misses' ]
+
+metrics_path = None
+page_metrics = None
+metrics_lock = threading.Lock()
+
+running_stages = dict((stage, 0) for stage in STAGES)
+stage_starts = dict((stage, None) for stage in STAGES)
+
+class StageTimer:
+
+  def __init__(self, stage):
+    self.stage = stage
+
+  def __enter__(self):
+
+    # The columns of a page may be timed from several threads, the stage runs from the first one
+    with metrics_lock:
+      if running_stages[self.stage] == 0:
+        stage_starts[self.stage] = time.time()
+
+      running_stages[self.stage] += 1
+
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+
+    # Wall clock time, until the last thread leaves the stage
+    with metrics_lock:
+      running_stages[self.stage] -= 1
+      if page_metrics != None:
+        page_metrics['calls'][self.stage] += 1
+        if running_stages[self.stage] == 0:
+          page_metrics['times'][self.stage] += time.time() - stage_starts[self.stage]
+
+    return False
+
+class NullTimer:
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    return False
+
+NULL_TIMER = NullTimer()
+
+def set_metrics_output(path):
+  global metrics_path, page_metrics
+
+  # None disables the instrumentation
+  metrics_path = path
+  page_metrics = None
+
+def start_page(image_path):
+  global page_metrics
+
+  if metrics_path == None:
+    return
+
+  page_metrics = {
+    'image'    : image_path,
+    'pid'      : os.getpid(),
+    'start'    : time.time(),
+    'times'    : dict((stage, 0.0) for stage in STAGES),
+    'calls'    : dict((stage, 0) for stage in STAGES),
+    'counters' : dict((counter, 0) for counter in COUNTERS)
+  }
+
+def end_page():
+  global page_metrics
+
+  if page_metrics == None:
+    return
+
+  record = page_metrics
+  record['total'] = time.time() - record.pop('start')
+  page_metrics = None
+
+  write_record(record)
+
+def timed(stage):
+
+  # Shared no-op timer when disabled
+  if page_metrics == None:
+    return NULL_TIMER
+
+  return StageTimer(stage)
+
+def count(counter, amount=1):
+  with metrics_lock:
+    if page_metrics != None:
+      page_metrics['counters'][counter] += amount
+
+def write_record(record):
+  create_basedir(metrics_path)
+
+  # A single append write per page, the workers share the file
+  if metrics_path.endswith('.csv'):
+    line = format_csv_record(record)
+  else:
+    line = json.dumps(record, sort_keys=True) + '\n'
+
+  with open(metrics_path, 'ab') as metrics_file:
+    metrics_file.write(line)
+
+def format_csv_record(record):
+  fieldnames = get_csv_fieldnames()
+
+  row = { 'image': record['image'], 'pid': record['pid'], 'total': record['total'] }
+  for stage in STAGES:
+    row[stage + '_time'] = record['times'][stage]
+    row[stage + '_runs'] = record['calls'][stage]
+
+  for counter in COUNTERS:
+    row[counter] = record['counters'][counter]
+
+  values = [row[name] for name in fieldnames]
+
+  # Header only for a new file
+  lines = []
+  if (not os.path.exists(metrics_path)) or (os.path.getsize(metrics_path) == 0):
+    lines.append(','.join(fieldnames))
+
+  lines.append(','.join(format_csv_value(value) for value in values))
+
+  return '\n'.join(lines) + '\n'
+
+def format_csv_value(value):
+  if isinstance(value, float):
+    return '%.6f' % value
+
+  value = str(value)
+  if (',' in value) or ('"' in value):
+    return '"' + value.replace('"', '""') + '"'
+
+  return value
+
+def get_csv_fieldnames():
+  fieldnames = [ 'image', 'pid', 'total' ]
+  for stage in STAGES:
+    fieldnames += [ stage + '_time', stage + '_runs' ]
+
+  return fieldnames + COUNTERS
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import cv2
+
+# Shorter lines are faster with the cv2 filters
+MIN_LOG_LINE_LENGTH = 64
+
+def dilate_rect(img, size):
+  return filter_rect(img, size, cv2.dilate, cv2.max, 0)
+
+def erode_rect(img, size):
+  return filter_rect(img, size, cv2.erode, cv2.min, 255)
+
+def close_rect(img, size):
+  return erode_rect(dilate_rect(img, size), size)
+
+def open_rect(img, size):
+  return dilate_rect(erode_rect(img, size), size)
+
+def filter_rect(img, size, cv2_filter, op, pad_value):
+  rows, cols = size
+
+  if max(rows, cols) < MIN_LOG_LINE_LENGTH:
+    return cv2_filter(img, np.ones(size, np.uint8))
+
+  # A rectangle is a horizontal line followed by a vertical one
+  filtered = filter_line(img, cols, 1, cv2_filter, op, pad_value)
+  return filter_line(filtered, rows, 0, cv2_filter, op, pad_value)
+
+def filter_line(img, length, axis, cv2_filter, op, pad_value):
+  if length == 1:
+    return img
+
+  if length < MIN_LOG_LINE_LENGTH:
+    size = (1, length) if axis == 1 else (length, 1)
+    return cv2_filter(img, np.ones(size, np.uint8))
+
+  # Same window and anchor as cv2, the border never wins
+  anchor = length // 2
+  before, after = anchor, length - 1 - anchor
+  if axis == 1:
+    src = cv2.copyMakeBorder(img, 0, 0, before, after, cv2.BORDER_CONSTANT, value=pad_value)
+  else:
+    src = cv2.copyMakeBorder(img, before, after, 0, 0, cv2.BORDER_CONSTANT, value=pad_value)
+
+  dst = np.empty_like(src)
+  size = img.shape[axis]
+  line = lambda arr, start, stop: arr[:, start:stop] if axis == 1 else arr[start:stop]
+
+  # Each pass doubles the window: src[i] holds the op of src[i:i+span]
+  span = 1
+  valid = src.shape[axis]
+  while (2 * span) <= length:
+    op(line(src, 0, valid - span), line(src, span, valid), line(dst, 0, valid - span))
+    src, dst = dst, src
+    valid -= span
+    span *= 2
+
+  # Two overlapped windows cover the rest of the line
+  if span < length:
+    op(line(src, 0, size), line(src, length - span, length - span + size), line(dst, 0, size))
+    src = dst
+
+  return np.ascontiguousarray(line(src, 0, size))
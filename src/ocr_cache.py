@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+
+DEFAULT_CACHE_DIR = '.cache'
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024
+CACHE_FILENAME = 'ocr_cache.sqlite'
+EVICTION_RATIO = 0.9
+ENTRY_OVERHEAD = 100
+FLUSH_GETS = 256
+
+class OCRCache:
+
+  def __init__(self, cachedir=DEFAULT_CACHE_DIR, max_size=DEFAULT_CACHE_SIZE):
+    self.cachedir = cachedir
+    self.max_size = max_size
+
+    # Counters of this process
+    self.hits = 0
+    self.misses = 0
+
+    # Counters and access times not written yet, saved in batches
+    self.pending_hits = 0
+    self.pending_misses = 0
+    self.pending_accesses = {}
+
+    if not os.path.exists(cachedir):
+      try:
+        os.makedirs(cachedir)
+      except OSError:
+        pass
+
+    # The column threads of a page share the connection
+    dbpath = os.path.join(cachedir, CACHE_FILENAME)
+    self.connection = sqlite3.connect(dbpath, timeout=60, check_same_thread=False)
+    self.lock = threading.Lock()
+    self.connection.execute('PRAGMA journal_mode=WAL')
+    self.connection.execute('PRAGMA synchronous=NORMAL')
+
+    self.connection.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT, size INTEGER, last_access REAL)')
+    self.connection.execute('CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access)')
+    self.connection.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)')
+    self.connection.execute("INSERT OR IGNORE INTO counters VALUES ('hits', 0), ('misses', 0)")
+    self.connection.commit()
+
+    self.size = self.get_stored_size()
+
+  def get_key(self, img, config, version):
+    img = np.ascontiguousarray(img)
+
+    sha = hashlib.sha1()
+    sha.update(version)
+    sha.update(config)
+    sha.update(str(img.shape) + str(img.dtype))
+    sha.update(img.tobytes())
+
+    return sha.hexdigest()
+
+  def get(self, key):
+    with self.lock:
+      found = self.connection.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+
+      # Only reads, the workers do not wait for the write lock on each crop
+      if found == None:
+        self.misses += 1
+        self.pending_misses += 1
+      else:
+        self.hits += 1
+        self.pending_hits += 1
+        self.pending_accesses[key] = time.time()
+
+      if self.pending_hits + self.pending_misses >= FLUSH_GETS:
+        self.write_pending()
+        self.connection.commit()
+
+    return None if found == None else found[0]
+
+  def put(self, key, value):
+    size = len(value) + ENTRY_OVERHEAD
+
+    with self.lock:
+      self.connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)', (key, value, size, time.time()))
+      self.write_pending()
+      self.connection.commit()
+
+      self.size += size
+      if self.size > self.max_size:
+        self.evict()
+
+  def evict(self):
+
+    # Other processes may have written, so get the real size
+    self.size = self.get_stored_size()
+
+    # Remove the least recently used until the size is under the ratio
+    limit = self.max_size * EVICTION_RATIO
+    rows = self.connection.execute('SELECT key, size FROM results ORDER BY last_access')
+
+    evicted = []
+    for key, size in rows:
+      if self.size <= limit:
+        break
+
+      evicted.append((key,))
+      self.size -= size
+
+    self.connection.executemany('DELETE FROM results WHERE key = ?', evicted)
+    self.connection.commit()
+
+  def flush(self):
+    with self.lock:
+      self.write_pending()
+      self.connection.commit()
+
+  def write_pending(self):
+
+    # On the transaction of the caller
+    self.connection.executemany('UPDATE results SET last_access = ? WHERE key = ?',
+                                [(last_access, key) for key, last_access in self.pending_accesses.items()])
+    self.increment_counter('hits', self.pending_hits)
+    self.increment_counter('misses', self.pending_misses)
+
+    self.pending_hits = 0
+    self.pending_misses = 0
+    self.pending_accesses = {}
+
+  def increment_counter(self, name, amount):
+    if amount > 0:
+      self.connection.execute('UPDATE counters SET value = value + ? WHERE name = ?', (amount, name))
+
+  def get_stored_size(self):
+    stored_size = self.connection.execute('SELECT SUM(size) FROM results').fetchone()[0]
+    return stored_size or 0
+
+  def get_counters(self):
+    return dict(self.connection.execute('SELECT name, value FROM counters').fetchall())
+
+  def print_stats(self):
+    self.flush()
+    counters = self.get_counters()
+
+    print('\nOCR cache: ' + str(self.hits) + ' hits, ' + str(self.misses) + ' misses.')
+    print('Total: ' + str(counters['hits']) + ' hits, ' + str(counters['misses']) + ' misses, ' +
+          str(self.get_stored_size() / 1024) + ' KB stored.')
@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import re
+import threading
+import numpy as np
+import pytesseract
+from multiprocessing.pool import ThreadPool
+from .ocr_cache import OCRCache
+from .ocr_recording import RecordingEngine, ReplayEngine
+from .instrumentation import timed, count
+
+try:
+  import tesserocr
+except ImportError:
+  tesserocr = None
+
+PSM_PATTERN = re.compile(u'--psm\s+(\d+)')
+VARIABLE_PATTERN = re.compile(u'-c\s+(\w+)=(\S*)')
+DEFAULT_PSM = 3
+
+OCR_BACKENDS = [ 'auto', 'tesserocr', 'pytesseract', 'replay' ]
+
+ocr_backend = 'auto'
+ocr_engine_local = threading.local()
+ocr_recording_path = None
+ocr_replay_engine = None
+
+ocr_concurrency = 1
+ocr_pool = None
+ocr_pool_pid = None
+
+# Guards the lazy creations, the columns of a page may be read on threads
+ocr_lock = threading.Lock()
+
+ocr_cache_settings = None
+ocr_cache = None
+ocr_cache_pid = None
+
+class PersistentTesseract:
+
+  def __init__(self, lang='eng'):
+    self.api = tesserocr.PyTessBaseAPI(lang=lang)
+    self.defaults = {}
+
+  def version(self):
+    return 'tesserocr ' + tesserocr.tesseract_version()
+
+  def configure(self, config):
+    psm, variables = parse_config(config)
+
+    # Restore variables of the last call
+    for name in self.defaults:
+      if not name in variables:
+        self.api.SetVariable(name, self.defaults[name])
+
+    for name in variables:
+      if not name in self.defaults:
+        self.defaults[name] = self.api.GetVariableAsString(name) or ''
+
+      self.api.SetVariable(name, variables[name])
+
+    self.api.SetPageSegMode(psm)
+
+  def set_image(self, img, config):
+    self.configure(config)
+
+    img = np.ascontiguousarray(img)
+    height, width = img.shape[:2]
+    channels = 1 if len(img.shape) == 2 else img.shape[2]
+
+    self.api.SetImageBytes(img.tobytes(), width, height, channels, width * channels)
+
+  def image_to_string(self, img, config=''):
+    self.set_image(img, config)
+    return to_unicode(self.api.GetUTF8Text()).strip()
+
+  def image_to_lines(self, img, config=''):
+    self.set_image(img, config)
+    self.api.Recognize()
+
+    lines = []
+
+    level = tesserocr.RIL.TEXTLINE
+    for result in tesserocr.iterate_level(self.api.GetIterator(), level):
+      readed = result.GetUTF8Text(level)
+      box = result.BoundingBox(level)
+      if (readed == None) or (box == None):
+        continue
+
+      x1, y1, x2, y2 = box
+      lines.append((to_unicode(readed).strip(), (x1, y1, x2 - x1, y2 - y1)))
+
+    return lines
+
+class PytesseractEngine:
+
+  def __init__(self):
+    self.tesseract_version = None
+
+  def version(self):
+    if self.tesseract_version == None:
+      self.tesseract_version = 'pytesseract ' + str(pytesseract.get_tesseract_version())
+
+    return self.tesseract_version
+
+  def image_to_string(self, img, config=''):
+    return pytesseract.image_to_string(img, config=config)
+
+  def image_to_lines(self, img, config=''):
+    data = pytesseract.image_to_data(img, config=config, output_type=pytesseract.Output.DICT)
+
+    # Group words by line keeping the reading order
+    lines = {}
+    line_keys = []
+    for i in range(len(data['level'])):
+      text = unicode(data['text'][i]).strip()
+      if (data['level'][i] != 5) or (text == ''):
+        continue
+
+      key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+      box = (data['left'][i], data['top'][i], data['width'][i], data['height'][i])
+
+      if not key in lines:
+        lines[key] = ([], box)
+        line_keys.append(key)
+
+      words, line_box = lines[key]
+      words.append(text)
+      lines[key] = (words, union_rects(line_box, box))
+
+    return [(u' '.join(lines[key][0]), lines[key][1]) for key in line_keys]
+
+def union_rects(rect_a, rect_b):
+  x = min(rect_a[0], rect_b[0])
+  y = min(rect_a[1], rect_b[1])
+  stop_x = max(rect_a[0] + rect_a[2], rect_b[0] + rect_b[2])
+  stop_y = max(rect_a[1] + rect_a[3], rect_b[1] + rect_b[3])
+
+  return (x, y, stop_x - x, stop_y - y)
+
+def to_unicode(readed):
+  if not isinstance(readed, unicode):
+    readed = readed.decode('utf-8')
+
+  return readed
+
+def parse_config(config):
+  psm = DEFAULT_PSM
+
+  found_psm = PSM_PATTERN.search(config)
+  if found_psm:
+    psm = int(found_psm.group(1))
+
+  variables = dict(VARIABLE_PATTERN.findall(config))
+
+  return (psm, variables)
+
+def set_ocr_backend(backend):
+  global ocr_backend, ocr_engine_local, ocr_replay_engine
+
+  if not backend in OCR_BACKENDS:
+    raise ValueError('Unknown OCR backend: ' + str(backend))
+
+  if (backend == 'tesserocr') and (tesserocr == None):
+    raise ValueError('tesserocr is not installed')
+
+  ocr_backend = backend
+  ocr_engine_local = threading.local()
+  ocr_replay_engine = None
+
+def set_ocr_recording(path):
+  global ocr_recording_path, ocr_engine_local, ocr_replay_engine
+
+  # Destination of the results, or their source with the replay backend
+  if is_ocr_replay() and ((path == None) or (not os.path.exists(path))):
+    raise ValueError('The replay OCR backend needs an existing recording')
+
+  ocr_recording_path = path
+  ocr_engine_local = threading.local()
+  ocr_replay_engine = None
+
+def is_ocr_replay():
+  return ocr_backend == 'replay'
+
+def create_ocr_engine():
+  if is_ocr_replay():
+    return get_replay_engine()
+
+  engine = create_tesseract_engine()
+  if ocr_recording_path != None:
+    engine = RecordingEngine(engine, ocr_recording_path)
+
+  return engine
+
+def get_replay_engine():
+  global ocr_replay_engine
+
+  # The recording is loaded once and only read, all the threads share it
+  with ocr_lock:
+    if ocr_replay_engine == None:
+      ocr_replay_engine = ReplayEngine(ocr_recording_path)
+
+    return ocr_replay_engine
+
+def create_tesseract_engine():
+  use_api = (ocr_backend == 'tesserocr') or ((ocr_backend == 'auto') and (tesserocr != None))
+  if not use_api:
+    return PytesseractEngine()
+
+  try:
+    return PersistentTesseract()
+  except RuntimeError as exception:
+    if ocr_backend == 'tesserocr':
+      raise exception
+
+    return PytesseractEngine()
+
+def get_ocr_engine():
+
+  # One engine per process and thread, released with its thread
+  pid = os.getpid()
+  if getattr(ocr_engine_local, 'pid', None) != pid:
+    ocr_engine_local.engine = create_ocr_engine()
+    ocr_engine_local.pid = pid
+
+  return ocr_engine_local.engine
+
+def set_ocr_concurrency(concurrency, callers=1):
+  global ocr_concurrency, ocr_pool
+
+  if concurrency < 1:
+    raise ValueError('The OCR concurrency must be at least 1')
+
+  # Parallel calls already keep the cores busy, one OpenMP thread by Tesseract call
+  # (tesserocr reads it when loaded, so it has to come from the environment)
+  if concurrency * callers > 1:
+    os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
+  if (ocr_pool != None) and (ocr_pool_pid == os.getpid()):
+    ocr_pool.close()
+
+  ocr_concurrency = concurrency
+  ocr_pool = None
+
+def get_ocr_pool():
+  global ocr_pool, ocr_pool_pid
+
+  # Threads of a parent pool do not survive the fork of a worker
+  with ocr_lock:
+    pid = os.getpid()
+    if (ocr_pool == None) or (ocr_pool_pid != pid):
+      ocr_pool = ThreadPool(ocr_concurrency)
+      ocr_pool_pid = pid
+
+    return ocr_pool
+
+def set_ocr_cache(cachedir, max_size):
+  global ocr_cache_settings, ocr_cache
+
+  ocr_cache_settings = None if cachedir == None else (cachedir, max_size)
+  ocr_cache = None
+
+def get_ocr_cache():
+  global ocr_cache, ocr_cache_pid
+
+  # Recordings see every call, replays never reach Tesseract
+  if (ocr_cache_settings == None) or (ocr_recording_path != None):
+    return None
+
+  # SQLite connections can not be shared between processes
+  with ocr_lock:
+    pid = os.getpid()
+    if (ocr_cache == None) or (ocr_cache_pid != pid):
+      ocr_cache = OCRCache(*ocr_cache_settings)
+      ocr_cache_pid = pid
+
+    return ocr_cache
+
+def flush_ocr_cache():
+
+  # Only the cache opened by this process
+  if (ocr_cache != None) and (ocr_cache_pid == os.getpid()):
+    ocr_cache.flush()
+
+def ocr_image_to_string(img, config=''):
+  with timed('ocr'):
+    return cached_image_to_string(img, config)
+
+def ocr_images_to_strings(imgs, config=''):
+  with timed('ocr'):
+    return cached_images_to_strings(imgs, config)
+
+def ocr_image_to_lines(img, config=''):
+  with timed('ocr'):
+    return cached_image_to_lines(img, config)
+
+def cached_image_to_string(img, config):
+  return cached_images_to_strings([img], config)[0]
+
+def cached_images_to_strings(imgs, config):
+  cache = get_ocr_cache()
+
+  readeds = [None] * len(imgs)
+  keys = [None] * len(imgs)
+
+  # The cache is looked up here, out of the OCR threads
+  if cache != None:
+    version = get_ocr_engine().version()
+    for i, img in enumerate(imgs):
+      keys[i] = cache.get_key(img, config, version)
+      readeds[i] = cache.get(keys[i])
+
+  missing = [i for i, readed in enumerate(readeds) if readed == None]
+
+  if cache != None:
+    count('cache_hits', len(imgs) - len(missing))
+    count('cache_misses', len(missing))
+
+  count('ocr_calls', len(missing))
+  results = map_ocr(engine_image_to_string, [imgs[i] for i in missing], config)
+
+  # Results come back in the order of the images
+  for i, readed in zip(missing, results):
+    readeds[i] = readed
+    if cache != None:
+      cache.put(keys[i], readed)
+
+  return readeds
+
+def engine_image_to_string(img, config):
+  return get_ocr_engine().image_to_string(img, config)
+
+def map_ocr(function, imgs, config):
+  if (ocr_concurrency == 1) or (len(imgs) < 2):
+    return [function(img, config) for img in imgs]
+
+  return get_ocr_pool().map(lambda img: function(img, config), imgs, 1)
+
+def cached_image_to_lines(img, config):
+  engine = get_ocr_engine()
+  cache = get_ocr_cache()
+
+  if cache == None:
+    count('ocr_calls')
+    return engine.image_to_lines(img, config)
+
+  key = cache.get_key(img, 'lines ' + config, engine.version())
+  cached = cache.get(key)
+
+  if cached == None:
+    count('cache_misses')
+    count('ocr_calls')
+    lines = engine.image_to_lines(img, config)
+    cache.put(key, json.dumps(lines))
+  else:
+    count('cache_hits')
+    lines = [(line_str, tuple(line_box)) for line_str, line_box in json.loads(cached)]
+
+  return lines
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import numpy as np
+from .utils import create_basedir
+from .instrumentation import count
+
+def get_crop_key(img, config, kind):
+  img = np.ascontiguousarray(img)
+
+  # Without the engine version, a recording is replayed anywhere
+  sha = hashlib.sha1()
+  sha.update(kind)
+  sha.update(config)
+  sha.update(str(img.shape) + str(img.dtype))
+  sha.update(img.tobytes())
+
+  return sha.hexdigest()
+
+class RecordingEngine:
+
+  def __init__(self, engine, recordpath):
+    self.engine = engine
+    self.recordpath = recordpath
+    create_basedir(recordpath)
+
+  def version(self):
+    return self.engine.version()
+
+  def image_to_string(self, img, config=''):
+    readed = self.engine.image_to_string(img, config)
+    self.record(get_crop_key(img, config, 'string'), readed)
+
+    return readed
+
+  def image_to_lines(self, img, config=''):
+    lines = self.engine.image_to_lines(img, config)
+    self.record(get_crop_key(img, config, 'lines'), lines)
+
+    return lines
+
+  def record(self, key, result):
+
+    # Single append write per result, the workers share the file
+    line = json.dumps({ 'key': key, 'result': result }) + '\n'
+    with open(self.recordpath, 'ab') as recordfile:
+      recordfile.write(line)
+
+class ReplayEngine:
+
+  def __init__(self, recordpath):
+    self.recordpath = recordpath
+    self.results = {}
+
+    # A line torn when a recording process was killed is skipped
+    with open(recordpath, 'rb') as recordfile:
+      for line in recordfile:
+        try:
+          record = json.loads(line)
+          self.results[record['key']] = record['result']
+        except (ValueError, KeyError, TypeError):
+          continue
+
+  def version(self):
+    return 'replay'
+
+  def image_to_string(self, img, config=''):
+    return self.replay(get_crop_key(img, config, 'string'), u'')
+
+  def image_to_lines(self, img, config=''):
+    lines = self.replay(get_crop_key(img, config, 'lines'), [])
+    return [(line_str, tuple(line_box)) for line_str, line_box in lines]
+
+  def replay(self, key, default):
+    if key in self.results:
+      return self.results[key]
+
+    # Crops not recorded read as empty, the segmentation has changed
+    count('replay_misses')
+
+    return default
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+import cv2
+import numpy as np
+from .utils import crop_roi, binarize_image, get_rotation_matrix, warp_roi, get_source_rows, \
+                   get_angle_rotation_matrix, reduce_image, get_reduced_angle_rotation, \
+                   SKEW_PYRAMID_LEVELS
+from .instrumentation import timed
+from .page_strips import StripPage, STRIP_HEIGHT, open_tiff_strips
+
+class PageContext:
+
+  def __init__(self, image_path, page_roi):
+    self.image_path = image_path
+    self.page_roi = page_roi
+
+    # Intermediate results, computed once by page
+    self.gray = None
+    self.tiff_strips = None
+    self.rotation_matrix = None
+    self.rotation_estimated = False
+    self.binary = None
+    self.layout_binary = None
+    self.strip_binary = None
+
+  def load(self, stream=False):
+
+    # On streaming mode the uncompressed TIFF scans are decoded strip by strip, when readed
+    if stream:
+      self.tiff_strips = open_tiff_strips(self.image_path, self.page_roi)
+      if self.tiff_strips != None:
+        return True
+
+    # Decode straight to grayscale, the page is a view of the decoded image
+    with timed('decode'):
+      gray = cv2.imread(self.image_path, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+      return False
+
+    self.gray = crop_roi(gray, self.page_roi)
+    return True
+
+  def get_rotation_matrix(self):
+    if not self.rotation_estimated:
+      if self.tiff_strips != None:
+        self.rotation_matrix = self.get_strips_rotation_matrix()
+      else:
+        with timed('deskew'):
+          self.rotation_matrix = get_rotation_matrix(self.gray)
+      self.rotation_estimated = True
+
+    return self.rotation_matrix
+
+  def get_strips_rotation_matrix(self):
+    level = SKEW_PYRAMID_LEVELS
+
+    # The angle is estimated on the reduced page, reduced strip by strip
+    reduced_strips = []
+    for y, gray_strip in self.get_gray_strips():
+      with timed('deskew'):
+        reduced_strips.append(reduce_image(gray_strip, level))
+
+    with timed('deskew'):
+      rot_angle = get_reduced_angle_rotation(np.vstack(reduced_strips), level)
+      return get_angle_rotation_matrix(0.0 if rot_angle == None else rot_angle, self.get_shape())
+
+  def get_shape(self):
+    if self.tiff_strips != None:
+      return self.tiff_strips.shape
+
+    return self.gray.shape[:2]
+
+  def get_gray_strips(self):
+    (h, w) = self.get_shape()
+
+    for y in range(0, h, STRIP_HEIGHT):
+      yield (y, self.read_gray_rows(y, min(STRIP_HEIGHT, h - y)))
+
+  def read_gray_rows(self, y, h):
+    if self.tiff_strips == None:
+      return crop_roi(self.gray, (0, y, self.gray.shape[1], h))
+
+    with timed('decode'):
+      return self.tiff_strips.read(y, h)
+
+  def warp_gray(self, M, roi, interpolation=cv2.INTER_CUBIC):
+    if self.tiff_strips == None:
+      with timed('deskew'):
+        return warp_roi(self.gray, M, roi, interpolation)
+
+    # Only the rows of the scan under the roi are decoded, the matrix is moved to them
+    source_y, source_h = get_source_rows(M, roi, self.tiff_strips.shape[0])
+    source_gray = self.read_gray_rows(source_y, source_h)
+
+    M_source = M.copy()
+    M_source[:, 2] += M[:, 1] * source_y
+
+    with timed('deskew'):
+      return warp_roi(source_gray, M_source, roi, interpolation)
+
+  def deskew(self):
+
+    # Rotate the whole page, the binary page is computed again
+    M = self.get_rotation_matrix()
+    if M is None:
+      return
+
+    (h, w) = self.gray.shape[:2]
+    with timed('deskew'):
+      self.gray = cv2.warpAffine(self.gray, M, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+    self.rotation_matrix = None
+    self.binary = None
+    self.layout_binary = None
+
+  def get_binary(self):
+    if self.binary is None:
+      with timed('binarize'):
+        self.binary = binarize_image(self.gray)
+
+    return self.binary
+
+  def get_layout_binary(self):
+
+    # Only to find the layout, the crops readed by the OCR are deskewed apart with cubic interpolation
+    if self.layout_binary is None:
+      M = self.get_rotation_matrix()
+      if M is None:
+        self.layout_binary = self.get_binary()
+      else:
+        self.layout_binary = np.empty(self.gray.shape[:2], np.uint8)
+        for y, binary_strip in self.get_binary_strips(M, cv2.INTER_NEAREST):
+          self.layout_binary[y:y + binary_strip.shape[0]] = binary_strip
+
+    return self.layout_binary
+
+  def get_strip_binary(self, deskew=False, layout=False):
+
+    # Binary page built strip by strip, without full page copies
+    if self.strip_binary is None:
+      M = self.get_rotation_matrix() if deskew else None
+      (h, w) = self.get_shape()
+
+      # The layout is found as well on nearest pixels, cheaper to rotate
+      interpolation = cv2.INTER_NEAREST if layout else cv2.INTER_CUBIC
+
+      self.strip_binary = StripPage(w, h)
+      for y, binary_strip in self.get_binary_strips(M, interpolation):
+        self.strip_binary.append(binary_strip)
+
+    return self.strip_binary
+
+  def get_binary_strips(self, M, interpolation=cv2.INTER_CUBIC):
+    (h, w) = self.get_shape()
+
+    for y in range(0, h, STRIP_HEIGHT):
+      strip_roi = (0, y, w, min(STRIP_HEIGHT, h - y))
+
+      if M is None:
+        gray_strip = self.read_gray_rows(y, strip_roi[3])
+      else:
+        gray_strip = self.warp_gray(M, strip_roi, interpolation)
+
+      with timed('binarize'):
+        binary_strip = binarize_image(gray_strip)
+
+      yield (y, binary_strip)
+
+  def release_gray(self):
+
+    # Once the strips are built, only the deskewed crops need the gray page
+    self.gray = None
+    self.binary = None
+    self.layout_binary = None
+
+  def get_deskewed_crop(self, roi):
+
+    # Binary crop of the roi given on the deskewed coordinates
+    M = self.get_rotation_matrix()
+    if M is None:
+      return crop_roi(self.get_binary(), roi)
+
+    crop = self.warp_gray(M, roi)
+
+    with timed('binarize'):
+      return binarize_image(crop)
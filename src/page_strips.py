@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import cv2
+
+try:
+  from PIL import Image
+except ImportError:
+  Image = None
+
+STRIP_HEIGHT = 512
+
+# Modes of the TIFF scans decoded strip by strip, as cv2.imread would read them in grayscale
+TIFF_STRIP_MODES = [ '1', 'L', 'RGB' ]
+TIFF_READ_BLOCK = 4 * 1024 * 1024
+
+class StripPage:
+
+  def __init__(self, width, height):
+    self.shape = (height, width)
+    self.strips = []
+    self.filled = 0
+
+  def append(self, binary_strip):
+
+    # Eight pixels by byte, the page is never unpacked at once
+    strip_height = binary_strip.shape[0]
+    self.strips.append((self.filled, strip_height, np.packbits(binary_strip > 0, axis=1)))
+    self.filled += strip_height
+
+  def __getitem__(self, index):
+
+    # Only the slices of crop_roi, unpacked on demand
+    rows, cols = index
+    start_y, stop_y, step_y = rows.indices(self.shape[0])
+    start_x, stop_x, step_x = cols.indices(self.shape[1])
+
+    return self.read((start_x, start_y, max(stop_x - start_x, 0), max(stop_y - start_y, 0)))
+
+  def read(self, roi):
+    x, y, w, h = roi
+    crop = np.zeros((h, w), np.uint8)
+
+    start_byte = x // 8
+    stop_byte = (x + w + 7) // 8
+    bit_offset = x - (8 * start_byte)
+
+    for strip_y, strip_height, packed in self.strips:
+      top = max(y, strip_y)
+      bottom = min(y + h, strip_y + strip_height)
+      if top >= bottom:
+        continue
+
+      bits = np.unpackbits(packed[top - strip_y:bottom - strip_y, start_byte:stop_byte], axis=1)
+      crop[top - y:bottom - y] = bits[:, bit_offset:bit_offset + w]
+
+    crop *= 255
+    return crop
+
+  def get_ink_profile(self, roi, axis):
+    x, y, w, h = roi
+
+    # Axis 0 gives one value by column, axis 1 one value by row
+    profile = np.zeros(w, np.bool_) if axis == 0 else np.zeros(h, np.bool_)
+    for strip_y in range(y, y + h, STRIP_HEIGHT):
+      strip_height = min(STRIP_HEIGHT, y + h - strip_y)
+      strip_ink = self.read((x, strip_y, w, strip_height)).any(axis=axis)
+
+      if axis == 0:
+        profile |= strip_ink
+      else:
+        profile[strip_y - y:strip_y - y + strip_height] = strip_ink
+
+    return profile
+
+def find_boxes_on_strips(strip_page, transform, margin):
+  height, width = strip_page.shape[:2]
+
+  # Union-find over the components of each strip
+  parents = {}
+  boxes = {}
+
+  def find(node):
+    while parents[node] != node:
+      parents[node] = parents[parents[node]]
+      node = parents[node]
+    return node
+
+  last_labels = None
+  for i, strip_y in enumerate(range(0, height, STRIP_HEIGHT)):
+    strip_height = min(STRIP_HEIGHT, height - strip_y)
+
+    # Transform with rows of context, only the rows of the strip are exact
+    top = max(0, strip_y - margin)
+    bottom = min(height, strip_y + strip_height + margin)
+    transformed = transform(strip_page.read((0, top, width, bottom - top)))
+    strip_img = np.ascontiguousarray(transformed[strip_y - top:strip_y - top + strip_height])
+
+    num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(strip_img, connectivity=8)
+    for label in range(1, num_labels):
+      node = (i, label)
+      parents[node] = node
+      boxes[node] = (int(stats[label, cv2.CC_STAT_LEFT]), strip_y + int(stats[label, cv2.CC_STAT_TOP]),
+                     int(stats[label, cv2.CC_STAT_WIDTH]), int(stats[label, cv2.CC_STAT_HEIGHT]))
+
+    # Join the components touching over the seam, with 8-connectivity
+    if last_labels is not None:
+      first_labels = labels[0]
+      for shift in (-1, 0, 1):
+        above = last_labels[max(0, shift):width + min(0, shift)]
+        below = first_labels[max(0, -shift):width + min(0, -shift)]
+        touching = (above > 0) & (below > 0)
+
+        for above_label, below_label in set(zip(above[touching], below[touching])):
+          parents[find((i - 1, int(above_label)))] = find((i, int(below_label)))
+
+    last_labels = labels[-1]
+
+  # Bounding box of each joined component
+  joined = {}
+  for node in boxes:
+    root = find(node)
+    joined[root] = boxes[node] if not root in joined else union_boxes(joined[root], boxes[node])
+
+  return joined.values()
+
+def union_boxes(box_a, box_b):
+  x = min(box_a[0], box_b[0])
+  y = min(box_a[1], box_b[1])
+  stop_x = max(box_a[0] + box_a[2], box_b[0] + box_b[2])
+  stop_y = max(box_a[1] + box_a[3], box_b[1] + box_b[3])
+
+  return (x, y, stop_x - x, stop_y - y)
+
+def open_tiff_strips(image_path, roi):
+
+  # Only the uncompressed TIFF scans give their strips or tiles, the others are decoded whole
+  if Image == None:
+    return None
+
+  try:
+    image = Image.open(image_path)
+  except IOError:
+    return None
+
+  if (image.format != 'TIFF') or (not image.mode in TIFF_STRIP_MODES):
+    return None
+
+  if (getattr(image, '_planar_configuration', 1) != 1) or (image.tag_v2.get(0x0112, 1) != 1):
+    return None
+
+  if any(tile[0] != 'raw' for tile in image.tile):
+    return None
+
+  bits = sum(image.tag_v2.get(258, (1,)))
+  return TiffStrips(image_path, image.size, image.tile, bits, roi)
+
+class TiffStrips:
+
+  def __init__(self, image_path, size, tiles, bits, roi):
+    self.image_path = image_path
+    self.size = size
+    self.tiles = tiles
+    self.bits = bits
+
+    # The page roi, clipped to the scan like crop_roi
+    width, height = size
+    x, y, w, h = roi
+    self.x = min(x, width)
+    self.y = min(y, height)
+    self.shape = (min(y + h, height) - self.y, min(x + w, width) - self.x)
+
+  def read(self, y, h):
+
+    # Rows of the page in grayscale, only the parts of the scan they cross are decoded
+    left, top = self.x, self.y + y
+    right, bottom = self.x + self.shape[1], top + h
+
+    tiles = self.get_tiles((left, top, right, bottom))
+    box_left = min(tile[1][0] for tile in tiles)
+    box_top = min(tile[1][1] for tile in tiles)
+    box_right = max(tile[1][2] for tile in tiles)
+    box_bottom = max(tile[1][3] for tile in tiles)
+
+    # The decoder fills an image of the box only
+    image = Image.open(self.image_path)
+    image.tile = [(name, (x0 - box_left, y0 - box_top, x1 - box_left, y1 - box_top), offset, args)
+                  for name, (x0, y0, x1, y1), offset, args in tiles]
+    image._size = (box_right - box_left, box_bottom - box_top)
+    image.decodermaxblock = max(image.decodermaxblock, TIFF_READ_BLOCK)
+    image.load()
+
+    if image.mode != 'L':
+      image = image.convert('L')
+
+    gray = np.asarray(image)
+    return gray[top - box_top:bottom - box_top, left - box_left:right - box_left]
+
+  def get_tiles(self, box):
+    left, top, right, bottom = box
+
+    tiles = []
+    for name, (x0, y0, x1, y1), offset, args in self.tiles:
+      if (x1 <= left) or (x0 >= right) or (y1 <= top) or (y0 >= bottom):
+        continue
+
+      # Full width strips are cut to the rows of the box, their rows are stored one after another
+      if (x0 == 0) and (x1 == self.size[0]):
+        stride = args[1] or (((x1 - x0) * self.bits) + 7) // 8
+        start_y = max(y0, top)
+        stop_y = min(y1, bottom)
+
+        offset += (start_y - y0) * stride
+        y0, y1 = start_y, stop_y
+
+        # Strips stored one after another are decoded as a single one
+        if (len(tiles) > 0) and self.is_next_strip(tiles[-1], (y0, offset, args), stride):
+          last_name, last_box, last_offset, last_args = tiles[-1]
+          tiles[-1] = (last_name, (x0, last_box[1], x1, y1), last_offset, last_args)
+          continue
+
+      tiles.append((name, (x0, y0, x1, y1), offset, args))
+
+    return tiles
+
+  def is_next_strip(self, tile, strip, stride):
+    name, (x0, y0, x1, y1), offset, args = tile
+    strip_y, strip_offset, strip_args = strip
+
+    full_width = (x0 == 0) and (x1 == self.size[0])
+    return full_width and (strip_y == y1) and (strip_offset == offset + ((y1 - y0) * stride)) and (strip_args == args)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import time
+import cv2
+
+QUEUE_FILENAME = 'queue.jsonl'
+DONE_FILENAME = 'done.txt'
+
+class ReviewQueue:
+
+  def __init__(self, queuedir):
+    self.queuedir = queuedir
+    self.queuepath = os.path.join(queuedir, QUEUE_FILENAME)
+    self.donepath = os.path.join(queuedir, DONE_FILENAME)
+    self.count = 0
+
+    if not os.path.exists(queuedir):
+      try:
+        os.makedirs(queuedir)
+      except OSError:
+        pass
+
+  def add(self, entry, images):
+
+    # Unique between processes writing to the same queue
+    self.count += 1
+    entry_id = '%d_%d_%d' % (int(time.time() * 1000), os.getpid(), self.count)
+
+    # Save the crops as PNG files
+    entry['id'] = entry_id
+    entry['images'] = {}
+    for name in images:
+      filename = entry_id + '_' + name + '.png'
+      cv2.imwrite(os.path.join(self.queuedir, filename), images[name])
+      entry['images'][name] = filename
+
+    # Single append write per entry
+    with open(self.queuepath, 'ab') as queuefile:
+      queuefile.write(json.dumps(entry) + '\n')
+
+    return entry_id
+
+  def entries(self):
+    if not os.path.exists(self.queuepath):
+      return []
+
+    done_ids = set()
+    if os.path.exists(self.donepath):
+      with open(self.donepath, 'rb') as donefile:
+        done_ids = set(line.strip() for line in donefile)
+
+    entries = []
+    with open(self.queuepath, 'rb') as queuefile:
+      for line in queuefile:
+        if line.strip() == '':
+          continue
+
+        entry = to_str(json.loads(line))
+        if not entry['id'] in done_ids:
+          entries.append(entry)
+
+    return entries
+
+  def load_image(self, entry, name):
+    filename = entry['images'][name]
+    return cv2.imread(os.path.join(self.queuedir, filename), cv2.IMREAD_GRAYSCALE)
+
+  def mark_done(self, entry):
+    with open(self.donepath, 'ab') as donefile:
+      donefile.write(entry['id'] + '\n')
+
+def to_str(value):
+
+  # JSON gives unicode strings, the parsers work with str
+  if isinstance(value, unicode):
+    return value.encode('utf-8')
+
+  if isinstance(value, list):
+    return [to_str(item) for item in value]
+
+  if isinstance(value, dict):
+    return dict((to_str(key), to_str(value[key])) for key in value)
+
+  return value
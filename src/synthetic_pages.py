@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import json
+import os
+import random
+import re
+import cv2
+import numpy as np
+from .utils import create_basedir
+from .catalogs_data import CatalogsData
+from .annuary.annuary_structure_detector import COL_WIDTH as ANNUARY_COL_WIDTH
+from .annuary.annuary_register_parser import parse_annuary_register_str, COMMUNITY_START_ID
+from .annuary.annuary_data import AnnuaryData
+from .diary.diary_structure_detector import COL_WIDTH as DIARY_COL_WIDTH, CONTENT_OFFSET
+from .diary.diary_module_parser import DiaryModuleParser, DiaryParsingException
+
+# Scans are letter pages at 600 dpi
+SYNTHETIC_PAGE_SIZE = (5100, 6600)
+SYNTHETIC_NAMES_PATH = 'csv/annuary.csv'
+TRUTH_FILENAME = 'truth.json'
+REFERENCES_FILENAME = 'references.csv'
+
+PAPER_COLOR = 235
+INK_COLOR = 35
+NOISE_SIGMA = 12
+SPECKLES_BY_PAGE = 400
+SPECKLE_COLOR = 120
+MAX_ANGLE = 0.5
+
+# The annuary is not deskewed, its second group of columns must start at the same x
+ANNUARY_MAX_ANGLE = 0.2
+
+# Annuary: two groups of three columns, text id, right aligned number and name
+ANNUARY_ORIGIN = (214, 885)
+ANNUARY_GROUP_SPACING = 150
+ANNUARY_ROWS_BY_COL = 57
+ANNUARY_ROW_PITCH = 36
+ANNUARY_CHAR_PITCH = 26
+ANNUARY_CHAR_HEIGHT = 24
+ANNUARY_NUMBER_END = 200
+ANNUARY_NAME_X = 226
+ANNUARY_MAX_NAME = 30
+
+# Diary: two groups of three columns of blocks, a header and rows of modules
+DIARY_ORIGIN = (231, 650)
+DIARY_GROUP_SPACING = 100
+DIARY_LINES_BY_COL = 56
+DIARY_LINE_PITCH = 35
+DIARY_CHAR_PITCH = 23.5
+DIARY_CHAR_HEIGHT = 22
+DIARY_CONTENT_X = CONTENT_OFFSET + 10
+DIARY_MAX_NAME = 26
+DIARY_MAX_ROWS = 4
+DIARY_MODULES_BY_ROW = 3
+DIARY_REFERENCES = 200
+DIARY_REFERENCE_START_ID = 5000
+MODULE_LENGTH = 10
+
+NAME_PATTERN = re.compile(u'^[A-Z][A-Z .]*$')
+TEXT_ID_PATTERN = re.compile(u'^[A-Z][A-Z]$')
+ZONE_CHARS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+CATALOG_KEY_PATTERN = re.compile(u'^[A-Z0-9_=]*$')
+
+glyphs = {}
+
+def get_glyph(char, height, width):
+  key = (char, height, width)
+  if key in glyphs:
+    return glyphs[key]
+
+  # Draw big, crop the ink and fit it in the cell of a typewriter
+  font = cv2.FONT_HERSHEY_SIMPLEX
+  baseline = 90
+  canvas = np.zeros((130, 120), np.uint8)
+  cv2.putText(canvas, char, (20, baseline), font, 2.4, 255, 7, cv2.LINE_AA)
+
+  ys, xs = np.nonzero(canvas)
+  canvas = canvas[ys.min():ys.max() + 1, xs.min():xs.max() + 1]
+
+  # Scaled to the height of the capitals
+  cap_height = cv2.getTextSize('H', font, 2.4, 7)[0][1]
+  scale = float(height) / cap_height
+
+  glyph_h, glyph_w = canvas.shape[:2]
+  size = (max(1, min(width, int(round(glyph_w * scale)))), max(1, int(round(glyph_h * scale))))
+
+  glyph = cv2.resize(canvas, size, interpolation=cv2.INTER_AREA)
+  glyphs[key] = (glyph, int(round((ys.min() - baseline) * scale)))
+
+  return glyphs[key]
+
+def draw_text(page, text, x, y, pitch, height):
+
+  # Monospaced, y is the baseline and blanks are spaces
+  width = int(pitch * 0.8)
+  for i, char in enumerate(text):
+    if (char == ' ') or (char == '_'):
+      continue
+
+    glyph, top = get_glyph(char, height, width)
+    glyph_h, glyph_w = glyph.shape[:2]
+
+    x0 = int(x + (i * pitch) + ((width - glyph_w) // 2))
+    y0 = y + top
+    cell = page[y0:y0+glyph_h, x0:x0+glyph_w]
+
+    # Darkest wins where glyphs touch
+    ink = PAPER_COLOR - ((glyph.astype(np.int32) * (PAPER_COLOR - INK_COLOR)) // 255)
+    np.minimum(cell, ink.astype(np.uint8), out=cell)
+
+def create_page():
+  width, height = SYNTHETIC_PAGE_SIZE
+  return np.full((height, width), PAPER_COLOR, np.uint8)
+
+def finish_page(page, rng, max_angle=MAX_ANGLE):
+  height, width = page.shape[:2]
+
+  # Small rotation of the sheet on the scanner
+  angle = rng.uniform(-max_angle, max_angle)
+  M = cv2.getRotationMatrix2D((width // 2, height // 2), angle, 1.0)
+  page = cv2.warpAffine(page, M, (width, height), flags=cv2.INTER_LINEAR, borderValue=PAPER_COLOR)
+
+  # Dust lighter than the ink and sensor noise
+  for i in range(SPECKLES_BY_PAGE):
+    center = (rng.randint(0, width - 1), rng.randint(0, height - 1))
+    cv2.circle(page, center, rng.randint(1, 3), rng.randint(SPECKLE_COLOR, PAPER_COLOR), -1)
+
+  page = cv2.GaussianBlur(page, (3, 3), 0)
+
+  noise = np.empty(page.shape, np.int16)
+  cv2.randn(noise, 0, NOISE_SIGMA)
+  noise += page
+
+  return (np.clip(noise, 0, 255).astype(np.uint8), angle)
+
+def load_names(names_path=SYNTHETIC_NAMES_PATH):
+
+  # Letter ids and person names of the annuary, only the printable ones
+  names = []
+  with open(names_path, 'rb') as csvfile:
+    annuary_reader = csv.DictReader(csvfile, delimiter=',', quotechar="'", quoting=csv.QUOTE_NONNUMERIC)
+
+    for register in annuary_reader:
+      name = ' '.join(register['name'].split())
+      if (register['type'] != 'person') or (not TEXT_ID_PATTERN.match(register['text_id'])):
+        continue
+
+      if NAME_PATTERN.match(name) and ('.' in name):
+        names.append((register['text_id'], name))
+
+  return names
+
+def to_printed_name(name):
+
+  # The printed name has a comma after the surnames
+  return name.replace('.', ',', 1)
+
+def create_register_str(text_id, num_id, name):
+  return text_id + ' ' + str(num_id) + ' ' + name
+
+def pick_register(rng, names, num_id, max_name):
+  while True:
+    text_id, name = rng.choice(names)
+    if len(name) <= max_name:
+      return create_register_str(text_id, num_id, name)
+
+def render_annuary_page(rng, names, first_id, max_angle=ANNUARY_MAX_ANGLE):
+  page = create_page()
+  registers = []
+
+  num_id = first_id
+  x0, y0 = ANNUARY_ORIGIN
+  group_height = (ANNUARY_ROWS_BY_COL * ANNUARY_ROW_PITCH) + ANNUARY_GROUP_SPACING
+
+  for group in range(2):
+    for col in range(3):
+      x = x0 + (col * ANNUARY_COL_WIDTH)
+
+      for row in range(ANNUARY_ROWS_BY_COL):
+        y = y0 + (group * group_height) + ((row + 1) * ANNUARY_ROW_PITCH)
+
+        register_str = pick_register(rng, names, num_id, ANNUARY_MAX_NAME)
+        text_id, number, name = register_str.split(' ', 2)
+
+        draw_text(page, text_id, x, y, ANNUARY_CHAR_PITCH, ANNUARY_CHAR_HEIGHT)
+        draw_text(page, number, x + ANNUARY_NUMBER_END - (len(number) * ANNUARY_CHAR_PITCH), y, ANNUARY_CHAR_PITCH, ANNUARY_CHAR_HEIGHT)
+        draw_text(page, to_printed_name(name), x + ANNUARY_NAME_X, y, ANNUARY_CHAR_PITCH, ANNUARY_CHAR_HEIGHT)
+
+        registers.append(parse_annuary_register_str(register_str))
+        num_id += 1
+
+  page, angle = finish_page(page, rng, max_angle)
+  return (page, registers)
+
+def generate_annuary_pages(output_dir, num_pages, seed=0, names_path=SYNTHETIC_NAMES_PATH, max_angle=ANNUARY_MAX_ANGLE):
+  registers_by_page = 6 * ANNUARY_ROWS_BY_COL
+  if (num_pages * registers_by_page) >= COMMUNITY_START_ID:
+    raise ValueError('Too many pages for the person IDs: ' + str(num_pages))
+
+  create_basedir(os.path.join(output_dir, TRUTH_FILENAME))
+
+  rng = random.Random(seed)
+  cv2.setRNGSeed(seed)
+  names = load_names(names_path)
+
+  pages = []
+  for i in range(num_pages):
+    page, registers = render_annuary_page(rng, names, 1 + (i * registers_by_page), max_angle)
+
+    filename = 'synthetic_%03d.jpg' % i
+    cv2.imwrite(os.path.join(output_dir, filename), page)
+    pages.append({ 'image': filename, 'registers': registers })
+
+  truth = { 'kind': 'annuary', 'seed': seed, 'pages': pages }
+  save_truth(output_dir, truth)
+
+  return truth
+
+def get_catalog_keys(catalogs_data, catalog_id, size):
+
+  # Keys the content OCR can read, blanks are printed as spaces
+  catalog = catalogs_data.get(catalog_id)
+  if catalog == None:
+    return []
+
+  keys = [key for key in catalog.registers if isinstance(key, str) and (len(key) == size)]
+  return sorted([key for key in keys if CATALOG_KEY_PATTERN.match(key)])
+
+def create_zone_str(rng, catalogs_data, catalog_id, size, references):
+  if catalog_id == 1:
+    return '%02d' % rng.randint(0, 99)
+
+  if (catalog_id == 32) or (catalog_id == 42):
+    return '%04d' % rng.choice(references)
+
+  keys = get_catalog_keys(catalogs_data, 9 if catalog_id == 27 else catalog_id, size)
+  if len(keys) == 0:
+    return ''.join(rng.choice(ZONE_CHARS) for i in range(size))
+
+  return rng.choice(keys)
+
+def create_module(rng, module_parser, references):
+  module_types = sorted(DiaryModuleParser.MODULE_ZONES)
+
+  # Only modules that the parser reads back as they are printed
+  while True:
+    module_type = rng.choice(module_types)
+
+    module_str = module_type
+    for catalog_id, size in DiaryModuleParser.MODULE_ZONES[module_type]:
+      module_str += create_zone_str(rng, module_parser.catalogs_data, catalog_id, size, references)
+
+    if len(module_str) != MODULE_LENGTH:
+      continue
+
+    try:
+      parsed = module_parser.parse_module_str(0, module_str, {})
+    except DiaryParsingException:
+      continue
+
+    return (module_str, '|'.join(parsed))
+
+def create_block(rng, names, num_id, module_parser, references, num_rows, full_rows):
+  header_str = pick_register(rng, names, num_id, DIARY_MAX_NAME)
+
+  rows = []
+  modules = []
+  for i in range(num_rows):
+    full_row = i in full_rows
+    num_modules = DIARY_MODULES_BY_ROW if full_row else rng.randint(1, DIARY_MODULES_BY_ROW)
+
+    row = []
+    while len(row) < num_modules:
+      module_str, parsed = create_module(rng, module_parser, references)
+
+      # The diary data keeps a module once by register
+      if parsed in modules:
+        continue
+
+      # A full row reaches the end of the column
+      if full_row and (module_str[-1] == DiaryModuleParser.SPACE_CHAR):
+        continue
+
+      row.append(module_str)
+      modules.append(parsed)
+
+    rows.append(' '.join(row))
+
+  return (header_str, rows, modules)
+
+def plan_diary_col(rng):
+
+  # Rows by block until the column is full, some blocks without content
+  blocks_rows = []
+  line = 0
+  while True:
+    num_rows = 0 if rng.random() < 0.1 else rng.randint(1, DIARY_MAX_ROWS)
+    if (line + 1 + num_rows) > DIARY_LINES_BY_COL:
+      return blocks_rows
+
+    blocks_rows.append(num_rows)
+    line += 1 + num_rows
+
+def get_header_lines(blocks_rows):
+  lines = []
+  line = 0
+  for num_rows in blocks_rows:
+    lines.append(line)
+    line += 1 + num_rows
+
+  return lines
+
+def plan_diary_group(rng):
+
+  # The columns are detected together only if a full row of a column is on
+  # the same line of a header of the next one
+  plans = [ plan_diary_col(rng) ]
+  full_lines = []
+  while len(plans) < 3:
+    header_lines = get_header_lines(plans[-1])
+    content_lines = [line + 1 + i for line, num_rows in zip(header_lines, plans[-1]) for i in range(num_rows)]
+
+    plan = plan_diary_col(rng)
+    shared = set(content_lines) & set(get_header_lines(plan))
+    if len(shared) > 0:
+      full_lines.append(set(shared))
+      plans.append(plan)
+
+  full_lines.append(set())
+  return zip(plans, full_lines)
+
+def render_diary_page(rng, names, first_id, module_parser, references, max_angle=MAX_ANGLE):
+  page = create_page()
+  blocks = []
+
+  num_id = first_id
+  x0, y0 = DIARY_ORIGIN
+  group_height = (DIARY_LINES_BY_COL * DIARY_LINE_PITCH) + DIARY_GROUP_SPACING
+
+  for group in range(2):
+    for col, (blocks_rows, full_lines) in enumerate(plan_diary_group(rng)):
+      x = x0 + (col * DIARY_COL_WIDTH)
+
+      for line, num_rows in zip(get_header_lines(blocks_rows), blocks_rows):
+        full_rows = [i for i in range(num_rows) if (line + 1 + i) in full_lines]
+
+        header_str, rows, modules = create_block(rng, names, num_id, module_parser, references, num_rows, full_rows)
+        header_id, header_number, header_name = header_str.split(' ', 2)
+        printed_header = '%s %4s %s' % (header_id, header_number, to_printed_name(header_name))
+
+        for i, text in enumerate([ printed_header ] + rows):
+          y = y0 + (group * group_height) + ((line + i + 1) * DIARY_LINE_PITCH)
+          text_x = x if i == 0 else (x + DIARY_CONTENT_X)
+          draw_text(page, text, text_x, y, DIARY_CHAR_PITCH, DIARY_CHAR_HEIGHT)
+
+        blocks.append({ 'header': parse_annuary_register_str(header_str), 'modules': modules })
+        num_id += 1
+
+  page, angle = finish_page(page, rng, max_angle)
+  return (page, blocks)
+
+def generate_diary_pages(output_dir, num_pages, seed=0, names_path=SYNTHETIC_NAMES_PATH, max_angle=MAX_ANGLE):
+  create_basedir(os.path.join(output_dir, TRUTH_FILENAME))
+
+  rng = random.Random(seed)
+  cv2.setRNGSeed(seed)
+  names = load_names(names_path)
+
+  # Registers referenced by the modules, the diary reads them from the annuary
+  references_data = AnnuaryData(os.path.join(output_dir, REFERENCES_FILENAME))
+  references = []
+  for i in range(DIARY_REFERENCES):
+    num_id = DIARY_REFERENCE_START_ID + i
+    references_data.add_register(parse_annuary_register_str(pick_register(rng, names, num_id, DIARY_MAX_NAME)))
+    references.append(num_id)
+
+  references_data.save()
+  module_parser = DiaryModuleParser(references_data)
+
+  pages = []
+  first_id = 1
+  for i in range(num_pages):
+    page, blocks = render_diary_page(rng, names, first_id, module_parser, references, max_angle)
+    first_id += len(blocks)
+
+    if first_id >= DIARY_REFERENCE_START_ID:
+      raise ValueError('Too many pages for the header IDs: ' + str(num_pages))
+
+    filename = 'synthetic_%03d.jpg' % i
+    cv2.imwrite(os.path.join(output_dir, filename), page)
+    pages.append({ 'image': filename, 'blocks': blocks })
+
+  truth = {
+    'kind'       : 'diary',
+    'seed'       : seed,
+    'references' : REFERENCES_FILENAME,
+    'pages'      : pages
+  }
+  save_truth(output_dir, truth)
+
+  return truth
+
+def save_truth(output_dir, truth):
+  with open(os.path.join(output_dir, TRUTH_FILENAME), 'wb') as truthfile:
+    json.dump(truth, truthfile, indent=1, sort_keys=True)
+
+def load_truth(output_dir):
+  with open(os.path.join(output_dir, TRUTH_FILENAME), 'rb') as truthfile:
+    return json.load(truthfile)
@@ -1,8 +1,21 @@
 # -*- coding: utf-8 -*-
 
 import cv2
+import csv
 import numpy as np
+import glob
+import os
+import sqlite3
+from multiprocessing.pool import ThreadPool
 from subprocess import check_output
+from .morphology import close_rect
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff')
+SQLITE_EXTENSIONS = ('.sqlite', '.db')
+
+SKEW_PYRAMID_LEVELS = 1
+SKEW_REDUCED_THRESHOLD = 200
+SKEW_MIN_AREA = 400000
 
 def get_tesseract_cmd():
   try:
@@ -12,10 +25,102 @@ def get_tesseract_cmd():
   
   return cmd.replace('\n', '')
 
+def ordered_thread_map(function, items, num_threads):
+
+  # Lazy on a single thread, the results are consumed as they are computed
+  if num_threads <= 1:
+    for item in items:
+      yield function(item)
+
+    return
+
+  # In the order of the items, while the next ones are computed
+  pool = ThreadPool(num_threads)
+  try:
+    for result in pool.imap(function, items):
+      yield result
+  finally:
+    pool.terminate()
+
+def is_batch_input(input_path):
+  return os.path.isdir(input_path) or glob.has_magic(input_path)
+
+def get_input_files(input_path):
+
+  # Directory or glob pattern
+  if os.path.isdir(input_path):
+    paths = [os.path.join(input_path, name) for name in os.listdir(input_path)]
+  else:
+    paths = glob.glob(input_path)
+
+  paths = [path for path in paths if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS)]
+  paths.sort()
+
+  return paths
+
+def create_basedir(path):
+  basedir = os.path.dirname(path)
+  if basedir and (not os.path.exists(basedir)):
+    os.makedirs(basedir)
+
+def is_sqlite_path(path):
+  return (path != None) and path.lower().endswith(SQLITE_EXTENSIONS)
+
+def connect_sqlite(dbpath):
+  create_basedir(dbpath)
+
+  # WAL lets the workers write while the others read, the busy ones wait
+  connection = sqlite3.connect(dbpath, timeout=60, check_same_thread=False)
+  connection.text_factory = str
+  connection.execute('PRAGMA journal_mode=WAL')
+  connection.execute('PRAGMA synchronous=NORMAL')
+
+  return connection
+
+def read_journal(journalpath, fieldnames):
+  with open(journalpath, 'rb') as journalfile:
+
+    # Line by line, a line torn when a process was killed is skipped and not the ones after it
+    for line in journalfile:
+      try:
+        values = next(csv.reader([line.rstrip('\r\n')], delimiter=',', quotechar="'", quoting=csv.QUOTE_NONNUMERIC, strict=True))
+      except (csv.Error, ValueError, StopIteration):
+        continue
+
+      if len(values) == len(fieldnames):
+        yield dict(zip(fieldnames, values))
+
 def crop_roi(image_src, roi):
   x, y, w, h = roi
   return image_src[y:y+h, x:x+w]
 
+def encode_png(img):
+
+  # Binary crops take a few KB as PNG
+  encoded, data = cv2.imencode('.png', img)
+  return data.tobytes()
+
+def decode_png(data):
+  return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE)
+
+def stack_images(images, padding):
+
+  # Stack images vertically over a black background
+  width = max([img.shape[1] for img in images]) + (2 * padding)
+  height = sum([img.shape[0] + padding for img in images]) + padding
+
+  mosaic = np.zeros((height, width), np.uint8)
+  slots = []
+
+  y = padding
+  for img in images:
+    h, w = img.shape[:2]
+    mosaic[y:y+h, padding:padding+w] = img
+    slots.append((padding, y, w, h))
+    y += h + padding
+
+  return mosaic, slots
+
 def show_scaled_image(title, img, scale):
 
   height, width = img.shape[:2]
@@ -27,11 +132,17 @@ def show_scaled_image(title, img, scale):
 
 def binarize_image(image_src):
 
-  gray = cv2.cvtColor(image_src, cv2.COLOR_BGR2GRAY)
+  gray = to_gray(image_src)
   ret, binary = cv2.threshold(gray, 100, 255, cv2.THRESH_BINARY_INV)
 
   return binary
 
+def to_gray(image_src):
+  if len(image_src.shape) == 2:
+    return image_src
+
+  return cv2.cvtColor(image_src, cv2.COLOR_BGR2GRAY)
+
 def draw_contours(binary_image, contours):
   channel = cv2.split(binary_image)[0]
 
@@ -56,38 +167,102 @@ def draw_boxes(img, boxes, stroke):
   return boxes_img
 
 def fix_image_rotation(img):
+  M = get_rotation_matrix(img)
+  if M is None:
+    return img
+
+  (h, w) = img.shape[:2]
+  rotated = cv2.warpAffine(img, M, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+  return rotated
+
+def get_rotation_matrix(img):
   rot_angle = get_img_angle_rotation(img)
-  if abs(rot_angle) > 0.4:
+  return get_angle_rotation_matrix(rot_angle, img.shape)
 
-    (h, w) = img.shape[:2]
-    center = (w // 2, 0)
-    M = cv2.getRotationMatrix2D(center, -rot_angle, 1.0)
-    rotated = cv2.warpAffine(img, M, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
-    return rotated
-  else:
-    return img
+def get_angle_rotation_matrix(rot_angle, shape):
+  if abs(rot_angle) <= 0.4:
+    return None
 
-def get_img_angle_rotation(img):
-  binary_image = binarize_image(img)
+  (h, w) = shape[:2]
+  center = (w // 2, 0)
+  return cv2.getRotationMatrix2D(center, -rot_angle, 1.0)
 
-  kernel_close = np.ones((75, 150), np.uint8)
-  image_close = cv2.morphologyEx(binary_image, cv2.MORPH_CLOSE, kernel_close)
+def warp_roi(img, M, roi, interpolation=cv2.INTER_CUBIC):
 
-  im2, contours, hierarchy = cv2.findContours(image_close, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+  # Only the roi of the rotated image, roi is on rotated coordinates
+  x, y, w, h = roi
+  M_roi = M.copy()
+  M_roi[0, 2] -= x
+  M_roi[1, 2] -= y
+
+  return cv2.warpAffine(img, M_roi, (w, h), flags=interpolation, borderMode=cv2.BORDER_REPLICATE)
+
+def get_source_rows(M, roi, height, margin=2):
+
+  # Rows of the unrotated image read by the roi, with the margin of the cubic interpolation
+  x, y, w, h = roi
+  corners = np.array([[[x, y]], [[x + w, y]], [[x, y + h]], [[x + w, y + h]]], np.float64)
+  source_corners = cv2.transform(corners, cv2.invertAffineTransform(M))
+
+  top = max(int(np.floor(source_corners[:, 0, 1].min())) - margin, 0)
+  bottom = min(int(np.ceil(source_corners[:, 0, 1].max())) + margin + 1, height)
 
-  ctrs = []
+  return (top, bottom - top)
+
+def get_img_angle_rotation(img, levels=SKEW_PYRAMID_LEVELS, refine=False):
+
+  # Estimate on a reduced level, refine on the next finer one if asked
+  angle = get_level_angle_rotation(img, levels)
+  if refine and (levels > 0) and (angle != None):
+    refined_angle = get_level_angle_rotation(img, levels - 1)
+    if refined_angle != None:
+      angle = refined_angle
+
+  return 0.0 if angle == None else angle
+
+def get_level_angle_rotation(img, level):
+  return get_reduced_angle_rotation(reduce_image(img, level), level)
+
+def reduce_image(img, level):
+
+  # Halved once by level
+  for i in range(level):
+    height, width = img.shape[:2]
+    img = cv2.resize(img, (width // 2, height // 2), interpolation=cv2.INTER_AREA)
+
+  return img
+
+def get_reduced_angle_rotation(img, level):
+
+  # The averaged strokes of a reduced image are lighter so the threshold is higher
+  scale = 2 ** level
+  if level > 0:
+    gray = to_gray(img)
+    binary_image = cv2.threshold(gray, SKEW_REDUCED_THRESHOLD, 255, cv2.THRESH_BINARY_INV)[1]
+  else:
+    binary_image = binarize_image(img)
+
+  # Kernel and area threshold scaled to the level
+  image_close = close_rect(binary_image, (75 // scale, 150 // scale))
+  min_area = SKEW_MIN_AREA / float(scale * scale)
+
+  im2, contours, hierarchy = cv2.findContours(image_close, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
 
   angle_sum = 0.0
   count = 0.0
   for contour in contours:
     area = cv2.contourArea(contour)
 
-    if area > 400000:
+    if area > min_area:
       angle = get_angle_contour(contour)
 
       angle_sum += angle
       count += 1.0
 
+  # Nothing large enough to measure
+  if count == 0:
+    return None
+
   return (angle_sum / count)
 
 def get_angle_contour(contour):
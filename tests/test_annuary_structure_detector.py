@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+# Run from the root of the project:
+#
+#   $ python -m unittest discover tests
+
+import os
+import unittest
+from src import PageContext, find_columns_on_annuary, find_rows_on_annuary, crop_roi
+
+IMAGES_DIR = 'images/annuary'
+PAGE_ROI = (80, 0, 3350, 5220)
+
+# The projection boxes are the union of the ink, the contour ones of a single component
+MAX_BOX_OFFSET = 5
+
+class FakeArgs:
+
+  def __init__(self, detector):
+    self.detector = detector
+    self.debug = False
+
+def find_page_boxes(binary_image, detector):
+  args = FakeArgs(detector)
+
+  # Rows on page coordinates, to compare the ones of shifted columns
+  cols = sorted(find_columns_on_annuary(binary_image, args))
+  rows = []
+  for col in cols:
+    col_x, col_y = col[:2]
+    col_rows = find_rows_on_annuary(crop_roi(binary_image, col), args)
+    rows.append(sorted((col_x + x, col_y + y, w, h) for x, y, w, h in col_rows))
+
+  return cols, rows
+
+class TestAnnuaryDetectors(unittest.TestCase):
+
+  def assertBoxesClose(self, boxes, expected_boxes, name):
+    self.assertEqual(len(boxes), len(expected_boxes), name)
+    for box, expected_box in zip(boxes, expected_boxes):
+      offset = max(abs(value - expected_value) for value, expected_value in zip(box, expected_box))
+      self.assertTrue(offset <= MAX_BOX_OFFSET, name + ': ' + str(box) + ' != ' + str(expected_box))
+
+  def test_projection_agrees_with_contours(self):
+    for name in sorted(os.listdir(IMAGES_DIR)):
+      page = PageContext(os.path.join(IMAGES_DIR, name), PAGE_ROI)
+      page.load()
+      binary_image = page.get_binary()
+
+      cols, rows = find_page_boxes(binary_image, 'contours')
+      projection_cols, projection_rows = find_page_boxes(binary_image, 'projection')
+
+      self.assertBoxesClose(projection_cols, cols, name)
+      for col_rows, projection_col_rows in zip(rows, projection_rows):
+        self.assertBoxesClose(projection_col_rows, col_rows, name)
+
+if __name__ == '__main__':
+  unittest.main()
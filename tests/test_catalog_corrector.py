@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+# Run from the root of the project:
+#
+#   $ python -m unittest discover tests
+
+import unittest
+from src import BKTree, CatalogCorrector, CatalogsData, confusion_distance
+
+class FakeCatalog:
+
+  def __init__(self, keys):
+    self.registers = dict((key, { 'key': key }) for key in keys)
+
+class FakeCatalogsData:
+
+  def __init__(self, catalogs):
+    self.catalogs = catalogs
+
+  def get(self, catalog_id):
+    return self.catalogs.get(catalog_id)
+
+class TestBKTree(unittest.TestCase):
+
+  def test_confusion_is_cheaper_than_substitution(self):
+    self.assertEqual(confusion_distance('O5', '05'), 1)
+    self.assertTrue(confusion_distance('ZZ', 'ZA') > 2)
+    self.assertEqual(confusion_distance('AB', 'ABC'), None)
+
+  def test_search_finds_keys_within_radius(self):
+    tree = BKTree([ 'CA', 'CS', 'DF', 'ME', 'OA', 'QU', 'DU' ])
+
+    self.assertEqual(sorted(tree.search('C5', 2)), [ (1, 'CS') ])
+    self.assertEqual(sorted(tree.search('OU', 1)), [ (1, 'DU'), (1, 'QU') ])
+    self.assertEqual(tree.search('ZZ', 2), [])
+
+class TestCatalogCorrector(unittest.TestCase):
+
+  def setUp(self):
+    catalog = FakeCatalog([ 'CA', 'CS', 'DF', 'ME', 'OA', 'QU', 'DU' ])
+    self.corrector = CatalogCorrector(FakeCatalogsData({ 3: catalog }))
+
+  def test_confusion_is_corrected(self):
+    self.assertEqual(self.corrector.correct(3, 'C5'), 'CS')
+    self.assertEqual(self.corrector.correct(3, '0A'), 'OA')
+
+  def test_substitution_is_rejected(self):
+    self.assertEqual(self.corrector.correct(3, 'ZZ'), None)
+    self.assertEqual(self.corrector.correct(3, 'CX'), None)
+
+  def test_tie_is_rejected(self):
+    self.assertEqual(self.corrector.correct(3, 'OU'), None)
+
+  def test_unknown_catalog(self):
+    self.assertEqual(self.corrector.correct(4, 'CA'), None)
+
+  def test_places_catalog(self):
+    corrector = CatalogCorrector(CatalogsData())
+
+    self.assertEqual(corrector.correct(3, 'ZZ'), None)
+    self.assertEqual(corrector.correct(3, 'C5'), 'CS')
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+# Run from the root of the project:
+#
+#   $ python -m unittest discover tests
+
+import os
+import shutil
+import tempfile
+import unittest
+import cv2
+import numpy as np
+from src import PageContext, open_tiff_strips
+from src.page_strips import Image
+
+IMAGE_PATH = 'images/diary/396.jpg'
+PAGE_ROI = (100, 50, 4800, 6400)
+
+@unittest.skipIf(Image == None, 'Pillow is not installed')
+class TestTiffStrips(unittest.TestCase):
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.gray = cv2.imread(IMAGE_PATH, cv2.IMREAD_GRAYSCALE)
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def write_tiff(self, name, compression):
+    path = os.path.join(self.tempdir, name)
+    cv2.imwrite(path, self.gray, [cv2.IMWRITE_TIFF_COMPRESSION, compression])
+    return path
+
+  def test_rows_are_decoded_as_whole(self):
+    tiff_strips = open_tiff_strips(self.write_tiff('strips.tif', 1), PAGE_ROI)
+    x, y, w, h = PAGE_ROI
+
+    self.assertEqual(tiff_strips.shape, (h, w))
+    self.assertTrue((tiff_strips.read(1001, 37) == self.gray[y + 1001:y + 1038, x:x + w]).all())
+
+  def test_compressed_tiff_is_decoded_whole(self):
+    self.assertEqual(open_tiff_strips(self.write_tiff('lzw.tif', 5), PAGE_ROI), None)
+    self.assertEqual(open_tiff_strips(IMAGE_PATH, PAGE_ROI), None)
+
+  def test_stream_page_equals_whole_page(self):
+    path = self.write_tiff('strips.tif', 1)
+
+    pages = []
+    for stream in [False, True]:
+      page = PageContext(path, PAGE_ROI)
+      page.load(stream)
+      pages.append(page)
+
+    whole_page, stream_page = pages
+    self.assertEqual(whole_page.tiff_strips, None)
+    self.assertNotEqual(stream_page.tiff_strips, None)
+
+    whole_M = whole_page.get_rotation_matrix()
+    stream_M = stream_page.get_rotation_matrix()
+    self.assertTrue(np.allclose(whole_M, stream_M))
+
+    whole_binary = whole_page.get_strip_binary(True)
+    stream_binary = stream_page.get_strip_binary(True)
+    roi = (0, 0, whole_binary.shape[1], whole_binary.shape[0])
+    self.assertTrue((whole_binary.read(roi) == stream_binary.read(roi)).all())
+
+if __name__ == '__main__':
+  unittest.main()